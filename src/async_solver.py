@@ -0,0 +1,57 @@
+"""Asyncio front-end for the solver.
+
+The search itself is a blocking loop, so it runs in an executor thread while
+the event loop stays free. Cancelling the awaiting task sets the solver's
+cancel event; the search stops at its next iteration and the frontier is
+released before the cancellation propagates.
+
+    task = asyncio.create_task(solve(data, on_progress=print))
+    ...
+    task.cancel()
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import Executor
+from typing import Callable, Optional
+
+import solver
+
+
+async def solve(
+    data: dict,
+    method: str = "bfs",
+    on_progress: Optional[Callable[[dict], None]] = None,
+    progress_interval: int = 1000,
+    executor: Optional[Executor] = None,
+    **limits,
+) -> dict:
+    loop = asyncio.get_running_loop()
+    cancel = threading.Event()
+
+    report = None
+    if on_progress is not None:
+        # progress is produced on the worker thread, hand it to the loop
+        def report(progress: dict):
+            loop.call_soon_threadsafe(on_progress, progress)
+
+    future = loop.run_in_executor(
+        executor,
+        functools.partial(
+            solver.solve,
+            data,
+            method,
+            cancel=cancel,
+            on_progress=report,
+            progress_interval=progress_interval,
+            **limits,
+        ),
+    )
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel.set()
+        # wait for the search to unwind so its memory is freed before returning
+        await asyncio.wait([future])
+        raise
@@ -1,23 +1,34 @@
 from utils import load_data
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+import copy
 import time
-from solver import solve
+import tracemalloc
+from generator import generate_level
+from solver import make_state, solve
+from state import State
+from tile import Tile
 import os
 from tabulate import tabulate
 import timeit
 import re
+import sys
 
 
-def benchmark_level(file_path: str) -> Dict[str, Dict[str, float]]:
+METHODS = ["dfs", "bfs", "cp"]
+
+
+def benchmark_level(
+    file_path: str, deadline_s: Optional[float] = None
+) -> Dict[str, Dict[str, float]]:
     data = load_data(file_path)
     results = {}
     print(f"Benchmarking {file_path}")
-    for method in ["dfs", "bfs"]:
+    for method in METHODS:
         # Use timeit for more accurate timing
         # but gonna take a lot of time to run
         # time_taken = timeit.timeit(lambda: solve(data, method), number=10)
         start = time.time()
-        solution = solve(data, method)
+        solution = solve(data, method, deadline_s=deadline_s)
         end = time.time()
         time_taken = end - start
         results[method] = {
@@ -25,11 +36,16 @@ def benchmark_level(file_path: str) -> Dict[str, Dict[str, float]]:
             "iterations": solution["iteration"]
             if solution["best_solution"] is not None
             else float("inf"),
+            "placed_tiles": solution["best_solution"].placed_tiles
+            if solution["best_solution"] is not None
+            else None,
         }
     return results
 
 
-def benchmark_all_levels(folder_path: str) -> Dict[str, Dict[str, Dict[str, float]]]:
+def benchmark_all_levels(
+    folder_path: str, deadline_s: Optional[float] = None
+) -> Dict[str, Dict[str, Dict[str, float]]]:
     all_results = {}
     levels = os.listdir(folder_path)
     # sort by number in it num-num
@@ -37,31 +53,193 @@ def benchmark_all_levels(folder_path: str) -> Dict[str, Dict[str, Dict[str, floa
     for filename in levels:
         if filename.endswith(".json"):
             file_path = os.path.join(folder_path, filename)
-            all_results[filename] = benchmark_level(file_path)
+            all_results[filename] = benchmark_level(file_path, deadline_s)
 
     return all_results
 
 
 def print_results_table(results: Dict[str, Dict[str, Dict[str, float]]]):
     table_data = []
-    headers = [
-        "Level",
-        "DFS Time",
-        "BFS Time",
-    ]
+    headers = ["Level"] + [f"{method.upper()} Time" for method in METHODS]
 
     for level, data in results.items():
-        row = [
-            level,
-            f"{data['dfs']['time']:.4f} ({data['dfs']['iterations']} iterations)",
-            f"{data['bfs']['time']:.4f} ({data['bfs']['iterations']} iterations)",
+        row = [level] + [
+            f"{data[method]['time']:.4f} ({data[method]['iterations']} iterations,"
+            f" {data[method]['placed_tiles']} tiles)"
+            for method in METHODS
         ]
         table_data.append(row)
 
     print(tabulate(table_data, headers=headers, tablefmt="rounded_outline"))
 
 
+def make_parallel_tracks_level(train_count: int, length: int) -> dict:
+    # every train runs up its own column and turns left along the top row
+    # into the destination in the corner. The trains never meet, so each
+    # tick pays the full collision check for all of them
+    grid = [[0] + [5] * train_count for _ in range(length)]
+    grid[0] = [6] + [14] * train_count
+    return {
+        "grid": grid,
+        "numberLayer": [[0] * (train_count + 1) for _ in range(length)],
+        "trains": [
+            {"x": x, "y": length - 1, "direction": 0, "order": x}
+            for x in range(1, train_count + 1)
+        ],
+        "destination": [0, 0],
+        "max_tracks": 0,
+    }
+
+
+def pairwise_collision(state: State) -> Optional[tuple[str, str]]:
+    """The collision check ``State.collision`` replaced, every pair of trains."""
+    for train in state.trains:
+        if train.position == state.destination:
+            continue
+        if not (
+            0 <= train.position.x < state.grid.width
+            and 0 <= train.position.y < state.grid.height
+        ):
+            return ("collision", "train run out of the board")
+        if state.grid.get(*train.position) == Tile.FENCE:
+            return ("collision", "train hit FENCE")
+        for other_train in state.trains:
+            if train == other_train:
+                continue
+            if train.position == other_train.position:
+                return ("collision", "train collision")
+            if (
+                train.position == other_train.previous_position
+                and train.previous_position == other_train.position
+            ):
+                return ("collision", "train collision")
+    return None
+
+
+def benchmark_collisions(
+    train_counts=(2, 5, 10, 20, 50, 100), length: int = 200
+) -> Dict[int, Dict[str, float]]:
+    """Time one collision check per tick, pairwise and with occupancy sets."""
+    checks = {"pairwise": pairwise_collision, "sets": State.collision}
+    results = {}
+    for train_count in train_counts:
+        state = make_state(make_parallel_tracks_level(train_count, length))
+        ticks = []
+        while (result := state.step()) is None:
+            ticks.append(copy.deepcopy(state.trains))
+        assert result[0] == "success", result
+        results[train_count] = {}
+        for name, check in checks.items():
+            start = time.perf_counter()
+            for trains in ticks:
+                state.trains = trains
+                check(state)
+            results[train_count][name] = (time.perf_counter() - start) / len(ticks)
+    return results
+
+
+def print_collision_table(results: Dict[int, Dict[str, float]]):
+    table_data = [
+        [
+            train_count,
+            f"{times['pairwise'] * 1e6:.1f}",
+            f"{times['sets'] * 1e6:.1f}",
+            f"{times['pairwise'] / times['sets']:.1f}x",
+        ]
+        for train_count, times in results.items()
+    ]
+    headers = ["Trains", "Pairwise per tick (us)", "Sets per tick (us)", "Speedup"]
+    print(tabulate(table_data, headers=headers, tablefmt="rounded_outline"))
+
+
+def benchmark_scaling(
+    sizes=((4, 4), (5, 5), (6, 6), (7, 7), (8, 8)),
+    train_counts=(1, 2, 3),
+    method: str = "dfs",
+    seeds=(0, 1, 2),
+    deadline_s: Optional[float] = 30,
+) -> Dict[tuple, Dict[str, float]]:
+    """Solve generated levels of every size and train count.
+
+    Time and peak traced memory are averaged over the seeds. Tracing slows
+    the solver down several times, so the time comes from a plain run and
+    the memory from a second, traced run over the same number of nodes.
+    """
+    results = {}
+    for width, height in sizes:
+        for train_count in train_counts:
+            times, memories, solved = [], [], 0
+            for seed in seeds:
+                data, _ = generate_level(
+                    width, height, train_count, fence_density=0.1, seed=seed
+                )
+                start = time.perf_counter()
+                solution = solve(data, method, deadline_s=deadline_s)
+                times.append(time.perf_counter() - start)
+                solved += solution["status"] == "complete"
+                tracemalloc.start()
+                solve(data, method, max_nodes=solution["iteration"] + 1)
+                memories.append(tracemalloc.get_traced_memory()[1] / 2**20)
+                tracemalloc.stop()
+            results[(width, height, train_count)] = {
+                "time": sum(times) / len(times),
+                "memory": sum(memories) / len(memories),
+                "solved": solved / len(seeds),
+            }
+    return results
+
+
+def print_scaling_table(results: Dict[tuple, Dict[str, float]]):
+    table_data = [
+        [
+            f"{width}x{height}",
+            train_count,
+            f"{data['time']:.4f}",
+            f"{data['memory']:.2f}",
+            f"{data['solved']:.0%}",
+        ]
+        for (width, height, train_count), data in results.items()
+    ]
+    headers = ["Board", "Trains", "Time (s)", "Peak memory (MB)", "Complete"]
+    print(tabulate(table_data, headers=headers, tablefmt="rounded_outline"))
+
+
+def plot_scaling(results: Dict[tuple, Dict[str, float]], path: str = "scaling.png"):
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, skipping the plot")
+        return
+    figure, (time_axis, memory_axis) = plt.subplots(1, 2, figsize=(12, 5))
+    for train_count in sorted({key[2] for key in results}):
+        keys = [key for key in results if key[2] == train_count]
+        cells = [width * height for width, height, _ in keys]
+        label = f"{train_count} train{'s' if train_count > 1 else ''}"
+        time_axis.plot(cells, [results[key]["time"] for key in keys], "o-", label=label)
+        memory_axis.plot(
+            cells, [results[key]["memory"] for key in keys], "o-", label=label
+        )
+    time_axis.set(xlabel="Cells", ylabel="Time (s)", yscale="log")
+    memory_axis.set(xlabel="Cells", ylabel="Peak memory (MB)", yscale="log")
+    time_axis.legend()
+    memory_axis.legend()
+    figure.tight_layout()
+    figure.savefig(path)
+    print(f"Saved {path}")
+
+
 if __name__ == "__main__":
-    levels_folder = "./src/levels"
-    results = benchmark_all_levels(levels_folder)
-    print_results_table(results)
+    if len(sys.argv) > 1 and sys.argv[1] == "collisions":
+        print_collision_table(benchmark_collisions())
+    elif len(sys.argv) > 1 and sys.argv[1] == "scaling":
+        results = benchmark_scaling()
+        print_scaling_table(results)
+        plot_scaling(results)
+    else:
+        levels_folder = "./src/levels"
+        # some levels take minutes with some methods, cap every run
+        results = benchmark_all_levels(levels_folder, deadline_s=60)
+        print_results_table(results)
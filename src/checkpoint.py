@@ -0,0 +1,218 @@
+"""Checkpoints of a running ``solve`` that a later call can resume from.
+
+The file is a log of zlib compressed pickles, each with a length prefix.
+The first one is a header that identifies the level and the method. After
+it comes a full snapshot of the search, followed by deltas. A delta only
+holds what changed since the previous record: how many states were popped
+from either end of the frontier, the states pushed since then that are
+still queued, and the nogoods learned. Once the deltas outgrow the last
+full snapshot, the log is compacted into a new snapshot, written to a
+temporary file and swapped in. A record cut short by a crash is ignored
+when the log is read back.
+
+    solve(data, "bfs", checkpoint="2-9.ckpt")
+    solve(data, "bfs", resume="2-9.ckpt")
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import struct
+import zlib
+from collections import deque
+from typing import Any, Optional
+
+from nogood import NogoodStore
+
+VERSION = 1
+_LENGTH = struct.Struct("<Q")
+
+
+def level_fingerprint(data: dict) -> str:
+    # the pattern database is derived from the level and may be added later
+    level = {key: value for key, value in data.items() if key != "patternDatabase"}
+    return hashlib.sha1(json.dumps(level, sort_keys=True).encode()).hexdigest()
+
+
+class FrontierJournal:
+    """Tracks how the frontier changed since the last record.
+
+    States are only ever pushed on the right, so the ones pushed since the
+    last record that are still queued are the rightmost ``pushed`` states.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.reset(size)
+
+    def reset(self, size: int) -> None:
+        # states left from the previous record
+        self.remaining = size
+        self.popped_left = 0
+        self.popped_right = 0
+        self.pushed = 0
+
+    def pop_left(self) -> None:
+        if self.remaining:
+            self.remaining -= 1
+            self.popped_left += 1
+        else:
+            self.pushed -= 1
+
+    def pop_right(self) -> None:
+        if self.pushed:
+            self.pushed -= 1
+        else:
+            self.remaining -= 1
+            self.popped_right += 1
+
+    def push(self, count: int) -> None:
+        self.pushed += count
+
+
+class CheckpointWriter:
+    def __init__(self, path: str, method: str, data: dict) -> None:
+        self.path = path
+        self.header = {
+            "version": VERSION,
+            "method": method,
+            "level": level_fingerprint(data),
+        }
+        self.file = None
+        self.full_size = 0
+        self.delta_size = 0
+        self.journal = FrontierJournal(0)
+        # nogood patterns already written, per key
+        self.nogoods_written: dict[tuple, int] = {}
+        self.best_solution_written = None
+
+    def write(
+        self, queue: deque, nogoods: Optional[NogoodStore], search: dict[str, Any]
+    ) -> None:
+        """Append the changes since the last call.
+
+        ``search`` holds the counters, the best solution and the ordering.
+        """
+        ordering = search["ordering"]
+        if self.file is None or self.delta_size > self.full_size:
+            # the snapshot holds the whole ordering, later deltas only changes
+            if ordering is not None:
+                ordering.take_changes()
+            self._write_full(queue, nogoods, search)
+        else:
+            changed = {
+                key: value
+                for key, value in search.items()
+                if key not in ("best_solution", "ordering")
+            }
+            if search["best_solution"] is not self.best_solution_written:
+                changed["best_solution"] = search["best_solution"]
+            record = {
+                "type": "delta",
+                "popped_left": self.journal.popped_left,
+                "popped_right": self.journal.popped_right,
+                "pushed": [queue[-i] for i in range(self.journal.pushed, 0, -1)],
+                "nogoods": self._new_nogoods(nogoods),
+                "search": changed,
+                "ordering": ordering.take_changes() if ordering is not None else {},
+            }
+            self.delta_size += self._append(self.file, record)
+        self.best_solution_written = search["best_solution"]
+        self.journal.reset(len(queue))
+
+    def _write_full(
+        self, queue: deque, nogoods: Optional[NogoodStore], search: dict[str, Any]
+    ) -> None:
+        if self.file is not None:
+            self.file.close()
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            self._append(file, self.header)
+            self.nogoods_written = {}
+            self.full_size = self._append(
+                file,
+                {
+                    "type": "full",
+                    "queue": list(queue),
+                    "nogoods": self._new_nogoods(nogoods),
+                    "search": search,
+                },
+            )
+        os.replace(temporary_path, self.path)
+        self.delta_size = 0
+        self.file = open(self.path, "ab")
+
+    def _new_nogoods(self, nogoods: Optional[NogoodStore]) -> dict[tuple, list]:
+        if nogoods is None:
+            return {}
+        new = {}
+        for key, patterns in nogoods.patterns.items():
+            written = self.nogoods_written.get(key, 0)
+            if len(patterns) > written:
+                new[key] = patterns[written:]
+                self.nogoods_written[key] = len(patterns)
+        return new
+
+    @staticmethod
+    def _append(file, record: Any) -> int:
+        payload = zlib.compress(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+        file.write(_LENGTH.pack(len(payload)) + payload)
+        file.flush()
+        os.fsync(file.fileno())
+        return _LENGTH.size + len(payload)
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _read_records(path: str):
+    with open(path, "rb") as file:
+        while True:
+            prefix = file.read(_LENGTH.size)
+            if len(prefix) < _LENGTH.size:
+                return
+            payload = file.read(_LENGTH.unpack(prefix)[0])
+            try:
+                yield pickle.loads(zlib.decompress(payload))
+            except (zlib.error, pickle.UnpicklingError, EOFError):
+                # the process died while writing this record
+                return
+
+
+def load_checkpoint(
+    path: str, method: str, data: dict
+) -> tuple[deque, NogoodStore, dict[str, Any]]:
+    """Rebuild the frontier, the nogoods and the search counters of ``path``."""
+    records = _read_records(path)
+    header = next(records, None)
+    if header is None or header.get("version") != VERSION:
+        raise ValueError(f"{path} is not a checkpoint")
+    if header["method"] != method or header["level"] != level_fingerprint(data):
+        raise ValueError(f"{path} was written for another level or method")
+
+    queue: deque = deque()
+    nogoods = NogoodStore()
+    search = None
+    for record in records:
+        if record["type"] == "full":
+            queue = deque(record["queue"])
+        else:
+            for _ in range(record["popped_left"]):
+                queue.popleft()
+            for _ in range(record["popped_right"]):
+                queue.pop()
+            queue.extend(record["pushed"])
+        for key, patterns in record["nogoods"].items():
+            nogoods.patterns[key].extend(patterns)
+            nogoods.size += len(patterns)
+        if record["type"] == "full":
+            search = record["search"]
+        else:
+            search.update(record["search"])
+            if record["ordering"]:
+                search["ordering"].apply_changes(record["ordering"])
+    if search is None:
+        raise ValueError(f"{path} holds no snapshot")
+    return queue, nogoods, search
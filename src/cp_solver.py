@@ -0,0 +1,405 @@
+"""Constraint propagation backend for ``solve(data, method="cp")``.
+
+Every free cell is a variable whose domain is the set of tiles that can be
+placed on it, T-turns and ``EMPTY`` included. The constraints are ones every
+solution meets:
+
+- Flow conservation. Two free cells next to each other either both have an
+  end on their shared edge or neither has, and ``EMPTY`` has no ends, so a
+  cell a placed tile points at can no longer stay empty. No end points off
+  the board. A tile placed next to a fixed tile must match it too, but the
+  fixed tile may point at a cell that stays empty.
+- Tile budget. The cells that can no longer stay empty, plus the other
+  empty cells on the cheapest route of any train through the domains, must
+  fit in the tiles left.
+- Arrival order. A train whose route to the destination is fully laid
+  arrives in a known number of steps, and every train that has to arrive
+  before it must be able to reach the destination in as many.
+
+Domains are kept arc consistent after every assignment and the budget and
+order are checked on every node.
+
+Cells are assigned in the order the trains reach them, so the tile must
+accept the train's direction and the cell it leads to must be able to take
+the train. Collisions are found by simulating the trains on the partial
+assignment. Cells no train reaches stay empty. The search is a depth-first
+branch and bound on the number of placed tiles.
+"""
+
+import copy
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from state import State, Train
+from tile import Direction, Position, Tile
+
+PLACEABLE_TILES = frozenset(
+    tile for tile in Tile if tile.is_straight or tile.is_curve or tile.is_t_turn
+)
+
+# the sides each tile has an end on
+_ENDS = {
+    tile: frozenset(
+        direction
+        for direction, connected in tile.get_connection_direction().items()
+        if connected
+    )
+    for tile in Tile
+}
+
+# tunnels move trains through ``State.effects`` instead of an output
+_OUTPUTS = {
+    (tile, direction): -1 if tile.is_tunnel else tile.get_output_direction(direction)
+    for tile in Tile
+    for direction in Direction
+}
+
+_DELTAS = {direction: direction.delta for direction in Direction}
+
+
+def _value_order(tile: Tile) -> tuple[int, int]:
+    # plain tracks first, they are what most solutions are made of
+    return (tile.is_t_turn, tile.value)
+
+
+Domains = dict[Position, frozenset[Tile]]
+
+
+@dataclass
+class Node:
+    state: State
+    domains: Domains
+    # cells trains reached this tick that still need to be checked
+    arrivals: list[tuple[Position, Direction]]
+
+
+def _on_board(state: State, position: Position) -> bool:
+    return 0 <= position.x < state.grid.width and 0 <= position.y < state.grid.height
+
+
+def initial_domains(state: State) -> Optional[Domains]:
+    """Domains of every cell, ``None`` if the level cannot be solved from ``state``."""
+    grid = state.grid
+    domains: Domains = {}
+    changed = []
+    for x in range(grid.width):
+        for y in range(grid.height):
+            position = Position(x, y)
+            tile = Tile(grid.get(x, y))
+            if tile != Tile.EMPTY:
+                # fixed tiles, and the tiles placed on a ``start`` state
+                domains[position] = frozenset([tile])
+                changed.append(position)
+                continue
+            domains[position] = frozenset(
+                tile
+                for tile in PLACEABLE_TILES | {Tile.EMPTY}
+                if all(
+                    _on_board(state, position + _DELTAS[direction])
+                    for direction in _ENDS[tile]
+                )
+            )
+            if len(domains[position]) <= len(PLACEABLE_TILES):
+                changed.append(position)
+    return propagate(state, domains, changed)
+
+
+def propagate(
+    state: State, domains: Domains, changed: list[Position]
+) -> Optional[Domains]:
+    """AC-3 from the ``changed`` cells. Returns ``None`` on a wipe-out."""
+    queue = deque(changed)
+    while queue:
+        position = queue.popleft()
+        fixed = position in state.immutable_positions
+        for direction in Direction:
+            neighbour = position + _DELTAS[direction]
+            if not _on_board(state, neighbour):
+                continue
+            if neighbour in state.immutable_positions:
+                continue
+            # whether the changed cell may have an end toward the neighbour
+            ends = {direction in _ENDS[tile] for tile in domains[position]}
+            side = direction.opposite
+            supported = frozenset(
+                tile
+                for tile in domains[neighbour]
+                if (side in _ENDS[tile]) in ends or (fixed and tile == Tile.EMPTY)
+            )
+            if supported == domains[neighbour]:
+                continue
+            if not supported:
+                return None
+            domains[neighbour] = supported
+            queue.append(neighbour)
+    return domains
+
+
+def _can_enter(
+    state: State, domains: Domains, position: Position, direction: Direction
+) -> bool:
+    if not _on_board(state, position):
+        return False
+    if position == state.destination or position in state.effects:
+        return True
+    return any(_OUTPUTS[(tile, direction)] != -1 for tile in domains[position])
+
+
+def _moves(
+    state: State, domains: Domains, position: Position, direction: Direction
+) -> list[tuple[Position, Direction]]:
+    """Where a train on ``position`` that entered it moving ``direction`` can go."""
+    if position in state.effects:
+        _, exit_position, exit_direction = state.effects[position]
+        moves = [(Position(*exit_position) + _DELTAS[exit_direction], exit_direction)]
+    else:
+        outputs = {_OUTPUTS[(tile, direction)] for tile in domains[position]}
+        outputs.discard(-1)
+        moves = [
+            (position + _DELTAS[output_direction], output_direction)
+            for output_direction in outputs
+        ]
+    return [move for move in moves if _on_board(state, move[0])]
+
+
+def _route_cost(
+    state: State, domains: Domains, train: Train, free: set[Position], budget: int
+) -> int:
+    """Fewest ``free`` cells on a route of ``train`` home, ``budget + 1`` if more.
+
+    A route may pass a T-turn twice but places it once, so costs are not
+    summed along the (cell, direction) moves. Those only decide which cells
+    lead to which, and the cost is that of the cheapest path between cells,
+    as every route visits all cells of some such path.
+    """
+    start = (train.position, train.direction)
+    neighbours: dict[Position, set[Position]] = {}
+    seen = {start}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        if node[0] == state.destination:
+            continue
+        for next_node in _moves(state, domains, *node):
+            neighbours.setdefault(node[0], set()).add(next_node[0])
+            if next_node not in seen:
+                seen.add(next_node)
+                queue.append(next_node)
+
+    distances = {train.position: int(train.position in free)}
+    queue = deque([train.position])
+    while queue:
+        position = queue.popleft()
+        distance = distances[position]
+        if position == state.destination:
+            return distance
+        for next_position in neighbours.get(position, ()):
+            cost = int(next_position in free)
+            next_distance = distance + cost
+            if next_distance > budget or next_distance >= distances.get(
+                next_position, budget + 1
+            ):
+                continue
+            distances[next_position] = next_distance
+            if cost:
+                queue.append(next_position)
+            else:
+                queue.appendleft(next_position)
+    return budget + 1
+
+
+def tiles_lower_bound(state: State, domains: Domains, limit: int) -> int:
+    """Tiles any solution below this node places, ``limit + 1`` once past it."""
+    cells = state.grid.data.tolist()
+    unassigned = [
+        position
+        for position in domains
+        if cells[position.y][position.x] == Tile.EMPTY
+    ]
+    forced = sum(Tile.EMPTY not in domains[position] for position in unassigned)
+    bound = state.placed_tiles + forced
+    if bound > limit:
+        return limit + 1
+    # forced cells are counted already, the routes add the ones that may
+    # still stay empty
+    free = {position for position in unassigned if Tile.EMPTY in domains[position]}
+    budget = limit - bound
+    cost = 0
+    for train in state.trains:
+        if train.position == state.destination:
+            continue
+        cost = max(cost, _route_cost(state, domains, train, free, budget))
+        if cost > budget:
+            return limit + 1
+    return bound + cost
+
+
+def _laid_steps(state: State, train: Train) -> Optional[int]:
+    """Steps ``train`` takes home on the tiles placed so far, ``None`` if unknown."""
+    position, direction = train.position, train.direction
+    for steps in range(state.max_steps):
+        if position == state.destination:
+            return steps
+        if position in state.effects:
+            _, exit_position, direction = state.effects[position]
+            position = Position(*exit_position) + _DELTAS[direction]
+        else:
+            tile = state.grid.get(*position)
+            if tile == Tile.EMPTY:
+                return None
+            direction = _OUTPUTS[(Tile(tile), direction)]
+            if direction == -1:
+                return None
+            position = position + _DELTAS[direction]
+        if not _on_board(state, position):
+            return None
+    return None
+
+
+def _fewest_steps(state: State, domains: Domains, train: Train) -> Optional[int]:
+    """Steps of the shortest route of ``train`` home, ``None`` if there is none."""
+    start = (train.position, train.direction)
+    steps = {start: 0}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        if node[0] == state.destination:
+            return steps[node]
+        for next_node in _moves(state, domains, *node):
+            if next_node not in steps:
+                steps[next_node] = steps[node] + 1
+                queue.append(next_node)
+    return None
+
+
+def order_violated(state: State, domains: Domains) -> bool:
+    """Whether a train is sure to arrive before one that must arrive first."""
+    trains = sorted(
+        (train for train in state.trains if train.position != state.destination),
+        key=lambda train: train.order,
+    )
+    fewest: dict[int, Optional[int]] = {}
+    for index, later in enumerate(trains):
+        if index == 0:
+            continue
+        laid = _laid_steps(state, later)
+        if laid is None:
+            continue
+        # trains arriving on the same step are sorted out by the simulation
+        for earlier in trains[:index]:
+            if earlier.order not in fewest:
+                fewest[earlier.order] = _fewest_steps(state, domains, earlier)
+            if fewest[earlier.order] is None or fewest[earlier.order] > laid:
+                return True
+    return False
+
+
+def _expand(node: Node, limit: int, stats: dict) -> list[Node]:
+    """Children of a node with pending arrivals, in the order to try them."""
+    state = node.state
+    position, direction = node.arrivals[0]
+    rest = node.arrivals[1:]
+    current = Tile(state.grid.get(*position))
+    if current != Tile.EMPTY:
+        # another train reached the same cell this tick
+        if current.get_output_direction(direction) == -1:
+            return []
+        return [Node(state, node.domains, rest)]
+    if state.placed_tiles + 1 > limit:
+        return []
+
+    children = []
+    for tile in sorted(node.domains[position], key=_value_order):
+        if tile == Tile.EMPTY:
+            continue
+        output_direction = tile.get_output_direction(direction)
+        if output_direction == -1:
+            continue
+        domains = dict(node.domains)
+        domains[position] = frozenset([tile])
+        domains = propagate(state, domains, [position])
+        if domains is None:
+            stats["wipeouts"] += 1
+            continue
+        if not _can_enter(
+            state, domains, position + output_direction.delta, output_direction
+        ):
+            continue
+        child = copy.deepcopy(state)
+        child.grid.set(position.x, position.y, tile)
+        child.placed_tiles += 1
+        children.append(Node(child, domains, rest))
+    return children
+
+
+def solve_cp(
+    state: State,
+    best_min_placed_tiles: int,
+    stop_reason: Callable[[int], Optional[str]],
+    report: Callable[[int, int, Optional[State]], None],
+) -> dict:
+    iteration = 0
+    status = "complete"
+    best_solution = None
+    stats = {
+        "first_solution_iteration": None,
+        "wipeouts": 0,
+        "tile_bound_prunes": 0,
+        "order_prunes": 0,
+    }
+    domains = initial_domains(state)
+    stack = [Node(state, domains, [])] if domains is not None else []
+    while stack:
+        reason = stop_reason(iteration)
+        if reason is not None:
+            status = reason
+            break
+        report(iteration, len(stack), best_solution)
+
+        iteration += 1
+        node = stack.pop()
+        # once a solution is known only strictly better ones are searched
+        limit = best_min_placed_tiles - (best_solution is not None)
+        if node.state.placed_tiles > limit:
+            continue
+        if tiles_lower_bound(node.state, node.domains, limit) > limit:
+            stats["tile_bound_prunes"] += 1
+            continue
+        if order_violated(node.state, node.domains):
+            stats["order_prunes"] += 1
+            continue
+
+        if node.arrivals:
+            # push in reverse so the preferred tile is tried first
+            stack.extend(reversed(_expand(node, limit, stats)))
+            continue
+
+        result = node.state.simulate()
+        if result[0] == "success":
+            best_solution = node.state
+            best_min_placed_tiles = node.state.placed_tiles
+            if stats["first_solution_iteration"] is None:
+                stats["first_solution_iteration"] = iteration
+        elif result[0] == "empty_pos_reached":
+            stack.append(Node(node.state, node.domains, result[1]))
+
+    limit = best_min_placed_tiles - (best_solution is not None)
+    # the bound of a node holds for everything below it
+    lower_bound = min(
+        (
+            bound
+            for node in stack
+            if (bound := tiles_lower_bound(node.state, node.domains, limit)) <= limit
+        ),
+        default=best_min_placed_tiles,
+    )
+    upper_bound = best_solution.placed_tiles if best_solution is not None else None
+    return {
+        "best_solution": best_solution,
+        "iteration": iteration,
+        "status": status,
+        "lower_bound": lower_bound,
+        "gap": upper_bound - lower_bound if upper_bound is not None else None,
+        "stats": stats,
+    }
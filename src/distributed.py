@@ -0,0 +1,380 @@
+"""Search one level on several machines.
+
+The coordinator expands the first ``depth`` levels of the search tree itself
+and hands the states left at that depth to workers as subproblems. Workers
+connect over plain TCP, run ``solve`` below each subproblem and report back.
+While a subproblem runs, the worker sends progress every
+``progress_interval`` iterations with the best tile count it has found, so
+the coordinator can prune the subproblems it has not handed out yet. The
+solution itself comes with the result. A worker that disconnects or stays
+silent for ``worker_timeout_s`` is dropped. Its subproblems are queued again,
+and the bounds it reported for them are withdrawn. The cp backend is not
+split, one worker searches the whole level.
+
+    python src/distributed.py coordinator ./src/levels/2-9.json --host 0.0.0.0 --allow-remote
+    python src/distributed.py worker --host 10.0.0.5 --port 8766
+
+Messages are pickled, so anyone who can connect to the coordinator can run
+code on it. It only listens on localhost unless ``--allow-remote`` is given,
+which should only be done between machines that trust each other.
+"""
+
+import argparse
+import multiprocessing
+import pickle
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Optional
+
+from level import make_state, max_tracks
+from solver import solve
+from state import State
+from utils import load_data
+
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+_LENGTH = struct.Struct("<Q")
+
+
+def send_message(sock: socket.socket, message: dict) -> None:
+    payload = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+def receive_message(sock: socket.socket) -> dict:
+    (length,) = _LENGTH.unpack(_receive_exactly(sock, _LENGTH.size))
+    return pickle.loads(_receive_exactly(sock, length))
+
+
+def _receive_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def split(
+    state: State, depth: int, best_min_placed_tiles: int
+) -> tuple[list[State], Optional[State], int]:
+    """Expand ``depth`` levels below ``state``.
+
+    Returns the states left at that depth, the best solution found on the
+    way and the number of states simulated.
+    """
+    frontier = [state]
+    best_solution = None
+    iteration = 0
+    for _ in range(depth):
+        next_frontier = []
+        for state in frontier:
+            if state.placed_tiles > best_min_placed_tiles:
+                continue
+            iteration += 1
+            result = state.simulate()
+            if result[0] == "success":
+                best_solution = state
+                best_min_placed_tiles = state.placed_tiles
+            elif result[0] == "empty_pos_reached":
+                next_frontier.extend(state.place_possible_tiles(result[1]))
+        frontier = next_frontier
+    return frontier, best_solution, iteration
+
+
+class Coordinator:
+    def __init__(
+        self,
+        data: dict,
+        method: str = "dfs",
+        depth: int = 2,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        worker_timeout_s: float = 60.0,
+        progress_interval: int = 1000,
+        **options,
+    ) -> None:
+        """``options`` are passed on to ``solve`` on the workers."""
+        if method not in ["bfs", "dfs", "cp"]:
+            raise ValueError("Invalid method")
+        self.data = data
+        self.method = method
+        self.worker_timeout_s = worker_timeout_s
+        self.options = dict(options, progress_interval=progress_interval)
+        self.start_time = time.perf_counter()
+
+        if method == "cp":
+            # subproblems hold curves and straights that later repairs may
+            # turn into T-turns, cp cannot change a placed tile, so it gets
+            # the whole level
+            depth = 0
+        self.best_min_placed_tiles = max_tracks(data)
+        subproblems, self.best_solution, self.iteration = split(
+            make_state(data), depth, self.best_min_placed_tiles
+        )
+        if self.best_solution is not None:
+            self.best_min_placed_tiles = self.best_solution.placed_tiles
+        self.tasks = dict(enumerate(subproblems))
+        self.pending = deque(self.tasks)
+        self.in_flight: set[int] = set()
+        # best tile counts reported for running subproblems, not yet backed
+        # by a solution the coordinator holds
+        self.claims: dict[int, int] = {}
+        self.status = "complete"
+        # subproblems skipped because of a claim, queued again when a claim
+        # is withdrawn or settled
+        self.deferred: list[int] = []
+        # lower bounds of the subproblems a limit stopped early
+        self.lower_bounds: list[int] = []
+        self.stats = {"subproblems": len(subproblems), "requeued": 0, "workers": 0}
+        self._condition = threading.Condition()
+
+        coordinator = self
+
+        class WorkerHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                coordinator._serve_worker(self.request)
+
+        self.server = socketserver.ThreadingTCPServer((host, port), WorkerHandler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+
+    def bound(self) -> int:
+        return min([self.best_min_placed_tiles, *self.claims.values()])
+
+    def finished(self) -> bool:
+        return not self.pending and not self.in_flight
+
+    def _next_task(self) -> Optional[int]:
+        """Wait for a subproblem worth searching, ``None`` once all are done."""
+        with self._condition:
+            while True:
+                while self.pending:
+                    task_id = self.pending.popleft()
+                    placed_tiles = self.tasks[task_id].placed_tiles
+                    if placed_tiles > self.best_min_placed_tiles:
+                        continue
+                    if placed_tiles > self.bound():
+                        self.deferred.append(task_id)
+                        continue
+                    self.in_flight.add(task_id)
+                    return task_id
+                if self.finished():
+                    self._condition.notify_all()
+                    return None
+                self._condition.wait()
+
+    def _serve_worker(self, sock: socket.socket) -> None:
+        sock.settimeout(self.worker_timeout_s)
+        owned: set[int] = set()
+        with self._condition:
+            self.stats["workers"] += 1
+        try:
+            send_message(
+                sock,
+                {
+                    "type": "level",
+                    "data": self.data,
+                    "method": self.method,
+                    "options": self.options,
+                },
+            )
+            while True:
+                message = receive_message(sock)
+                if message["type"] == "request":
+                    task_id = self._next_task()
+                    if task_id is None:
+                        send_message(sock, {"type": "done"})
+                        return
+                    owned.add(task_id)
+                    with self._condition:
+                        bound = self.bound()
+                    send_message(
+                        sock,
+                        {
+                            "type": "task",
+                            "id": task_id,
+                            "state": self.tasks[task_id],
+                            "best_min_placed_tiles": bound,
+                        },
+                    )
+                elif message["type"] == "progress":
+                    if message["best_placed_tiles"] is not None:
+                        with self._condition:
+                            self.claims[message["id"]] = message["best_placed_tiles"]
+                elif message["type"] == "result":
+                    self._finish(message)
+                    owned.discard(message["id"])
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        finally:
+            with self._condition:
+                for task_id in owned:
+                    self.in_flight.discard(task_id)
+                    self.claims.pop(task_id, None)
+                    self.pending.appendleft(task_id)
+                    self.stats["requeued"] += 1
+                self._requeue_deferred()
+                self._condition.notify_all()
+
+    def _finish(self, message: dict) -> None:
+        solution = message["best_solution"]
+        with self._condition:
+            self.in_flight.discard(message["id"])
+            self.claims.pop(message["id"], None)
+            self.iteration += message["iteration"]
+            if (
+                solution is not None
+                and solution.placed_tiles <= self.best_min_placed_tiles
+            ):
+                self.best_solution = solution
+                self.best_min_placed_tiles = solution.placed_tiles
+            if message["status"] != "complete":
+                self.status = message["status"]
+                self.lower_bounds.append(message["lower_bound"])
+            self._requeue_deferred()
+            self._condition.notify_all()
+
+    def _requeue_deferred(self) -> None:
+        # the claim that pruned them may be gone, ``_next_task`` checks again
+        self.pending.extend(self.deferred)
+        self.deferred.clear()
+
+    def run(self) -> dict:
+        """Serve workers until every subproblem is searched."""
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        with self._condition:
+            while not self.finished():
+                self._condition.wait()
+        self.server.shutdown()
+        self.server.server_close()
+
+        lower_bound = min([self.best_min_placed_tiles, *self.lower_bounds])
+        upper_bound = (
+            self.best_solution.placed_tiles if self.best_solution is not None else None
+        )
+        return {
+            "best_solution": self.best_solution,
+            "iteration": self.iteration,
+            "status": self.status,
+            "lower_bound": lower_bound,
+            "gap": upper_bound - lower_bound if upper_bound is not None else None,
+            "time": time.perf_counter() - self.start_time,
+            "stats": self.stats,
+        }
+
+
+def run_worker(host: str, port: int) -> None:
+    with socket.create_connection((host, port)) as sock:
+        level = receive_message(sock)
+        data, method, options = level["data"], level["method"], level["options"]
+        while True:
+            send_message(sock, {"type": "request"})
+            message = receive_message(sock)
+            if message["type"] == "done":
+                return
+
+            def on_progress(progress, task_id=message["id"]):
+                send_message(
+                    sock,
+                    {
+                        "type": "progress",
+                        "id": task_id,
+                        "best_placed_tiles": progress["best_placed_tiles"],
+                    },
+                )
+
+            bounded = dict(data, max_tracks=message["best_min_placed_tiles"])
+            solution = solve(
+                bounded,
+                method,
+                start=message["state"],
+                on_progress=on_progress,
+                **options,
+            )
+            send_message(
+                sock,
+                {
+                    "type": "result",
+                    "id": message["id"],
+                    "best_solution": solution["best_solution"],
+                    "iteration": solution["iteration"],
+                    "status": solution["status"],
+                    "lower_bound": solution["lower_bound"],
+                },
+            )
+
+
+def solve_distributed(
+    data: dict, workers: int = 4, method: str = "dfs", depth: int = 2, **options
+) -> dict[str, Any]:
+    """Run a coordinator and ``workers`` worker processes on this machine."""
+    coordinator = Coordinator(data, method, depth, **options)
+    host, port = coordinator.address
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(host, port), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        return coordinator.run()
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed Railbound search")
+    subparsers = parser.add_subparsers(dest="role", required=True)
+    coordinator_parser = subparsers.add_parser("coordinator")
+    coordinator_parser.add_argument("level")
+    coordinator_parser.add_argument("--host", default="127.0.0.1")
+    coordinator_parser.add_argument(
+        "--allow-remote",
+        action="store_true",
+        help="listen on a non-local address, workers can run code on this machine",
+    )
+    coordinator_parser.add_argument("--port", type=int, default=8766)
+    coordinator_parser.add_argument("--method", default="dfs")
+    coordinator_parser.add_argument("--depth", type=int, default=2)
+    coordinator_parser.add_argument("--worker-timeout", type=float, default=60.0)
+    worker_parser = subparsers.add_parser("worker")
+    worker_parser.add_argument("--host", default="127.0.0.1")
+    worker_parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    if args.role == "worker":
+        run_worker(args.host, args.port)
+    else:
+        if args.host not in LOCAL_HOSTS and not args.allow_remote:
+            parser.error(
+                f"listening on {args.host} lets anyone who connects run code,"
+                " pass --allow-remote to do it anyway"
+            )
+        coordinator = Coordinator(
+            load_data(args.level),
+            args.method,
+            args.depth,
+            args.host,
+            args.port,
+            worker_timeout_s=args.worker_timeout,
+        )
+        print(
+            f"Coordinator listening on {coordinator.address[0]}:{coordinator.address[1]}"
+            f" with {len(coordinator.tasks)} subproblems"
+        )
+        solution = coordinator.run()
+        print(
+            f'{solution["status"]} in {solution["time"]:.2f}s,'
+            f' {solution["iteration"]} iterations, {solution["stats"]}'
+        )
+        if solution["best_solution"] is not None:
+            print(f"Placed tiles: {solution['best_solution'].placed_tiles}")
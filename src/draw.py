@@ -1,113 +1,214 @@
-from grid import Grid
+from collections import OrderedDict
 from tile import Tile, Position
+from typing import Iterable
 from PIL import Image, ImageDraw
 from utils import load_data
 from state import State
 
 
+# The file names of these tiles do not follow the enum name
+IMAGE_NAMES = {Tile.EMPTY: "Empty"}
+
+BACKGROUND_COLOR = "#dbd692"
+
+# a level needs at most two backgrounds, with and without coordinates, so
+# this keeps the last four levels drawn
+MAX_BACKGROUNDS = 8
+
+
 class Draw:
     def __init__(self) -> None:
         self.tile_images = {}
         self.image_width = 90
         self.image_height = 90
         self.load_image()
+        # least recently used cache of each level's immutable tiles, keyed by
+        # the tiles themselves
+        self.backgrounds: OrderedDict = OrderedDict()
 
     def load_image(self):
         for tile in Tile:
-            self.tile_images[tile.value] = Image.open(f"./src/images/{tile.name}.png")
+            name = IMAGE_NAMES.get(tile, tile.name)
+            self.tile_images[tile.value] = self._composite(
+                Image.open(f"./src/images/{name}.png")
+            )
             if tile.is_curve or tile.is_straight:
-                self.tile_images[f"{tile.value}_2"] = Image.open(
-                    f"./src/images/{tile.name}_2.png"
+                self.tile_images[f"{tile.value}_2"] = self._composite(
+                    Image.open(f"./src/images/{tile.name}_2.png")
                 )
 
-    def draw(self, state: State, debug: bool = False, draw_cart: bool = False) -> None:
+    def _composite(self, img: Image.Image) -> Image.Image:
+        # Flatten the tile onto the background once, so cells can be pasted
+        # without an alpha mask.
+        tile = Image.new(
+            "RGBA", (self.image_width, self.image_height), BACKGROUND_COLOR
+        )
+        tile.alpha_composite(
+            img.convert("RGBA").resize((self.image_width, self.image_height))
+        )
+        return tile
+
+    def _background(self, state: State, debug: bool) -> Image.Image:
         grid = state.grid
+        key = (
+            grid.width,
+            grid.height,
+            debug,
+            frozenset(
+                (position, grid.get(*position)) for position in state.immutable_positions
+            ),
+        )
+        if key in self.backgrounds:
+            self.backgrounds.move_to_end(key)
+            return self.backgrounds[key]
+
         image = Image.new(
             "RGBA",
             (grid.width * self.image_width, grid.height * self.image_height),
-            "#dbd692",
+            BACKGROUND_COLOR,
         )
-        imageDrawer = ImageDraw.Draw(image)
         for y in range(grid.height):
             for x in range(grid.width):
-                tile = Tile(grid.get(x, y))
-                if Position(x, y) in state.immutable_positions and (
-                    tile.is_curve or tile.is_straight
-                ):
-                    img = self.tile_images[f"{tile.value}_2"]
+                if Position(x, y) in state.immutable_positions:
+                    tile = Tile(grid.get(x, y))
                 else:
-                    img = self.tile_images[tile.value]
-                image.paste(img, (x * self.image_width, y * self.image_height), img)
-                # draw x, y coordinates string on bottom left of the cell
-                if debug:
-                    imageDrawer.text(
-                        (x * self.image_width, y * self.image_height + 70),
-                        f"{x}, {y}",
-                        fill="black",
-                    )
+                    tile = Tile.EMPTY
+                self._paste_tile(image, x, y, tile, immutable=True)
+        if debug:
+            imageDrawer = ImageDraw.Draw(image)
+            for y in range(grid.height):
+                for x in range(grid.width):
+                    self._draw_coordinates(imageDrawer, x, y)
+        self.backgrounds[key] = image
+        if len(self.backgrounds) > MAX_BACKGROUNDS:
+            self.backgrounds.popitem(last=False)
+        return image
+
+    def _paste_tile(
+        self, image: Image.Image, x: int, y: int, tile: Tile, immutable: bool
+    ) -> None:
+        if immutable and (tile.is_curve or tile.is_straight):
+            img = self.tile_images[f"{tile.value}_2"]
+        else:
+            img = self.tile_images[tile.value]
+        image.paste(img, (x * self.image_width, y * self.image_height))
+
+    def _draw_coordinates(self, imageDrawer: ImageDraw.ImageDraw, x: int, y: int):
+        # draw x, y coordinates string on bottom left of the cell
+        imageDrawer.text(
+            (x * self.image_width, y * self.image_height + 70),
+            f"{x}, {y}",
+            fill="black",
+        )
+
+    def draw(
+        self, state: State, debug: bool = False, draw_cart: bool = False
+    ) -> Image.Image:
+        grid = state.grid
+        image = self._background(state, debug).copy()
+        imageDrawer = ImageDraw.Draw(image)
+        # only the tiles placed by the solver differ from the cached background
+        ys, xs = grid.data.nonzero()
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            if Position(x, y) in state.immutable_positions:
+                continue
+            self._paste_tile(image, x, y, Tile(grid.get(x, y)), immutable=False)
+            if debug:
+                self._draw_coordinates(imageDrawer, x, y)
         if draw_cart:
-            for train in state.trains:
-                # draw circle
-                imageDrawer.ellipse(
+            self.draw_trains(imageDrawer, state.trains)
+        return image
+
+    def draw_trains(self, imageDrawer: ImageDraw.ImageDraw, trains) -> None:
+        for train in trains:
+            # draw circle
+            imageDrawer.ellipse(
+                (
+                    train.position.x * self.image_width + 30,
+                    train.position.y * self.image_height + 30,
+                    train.position.x * self.image_width + 60,
+                    train.position.y * self.image_height + 60,
+                ),
+                fill="red",
+            )
+            # draw direction arrow
+            if train.direction == 0:
+                imageDrawer.line(
+                    (
+                        train.position.x * self.image_width + 45,
+                        train.position.y * self.image_height + 45,
+                        train.position.x * self.image_width + 45,
+                        train.position.y * self.image_height + 15,
+                    ),
+                    fill="black",
+                    width=2,
+                )
+            elif train.direction == 1:
+                imageDrawer.line(
+                    (
+                        train.position.x * self.image_width + 45,
+                        train.position.y * self.image_height + 45,
+                        train.position.x * self.image_width + 75,
+                        train.position.y * self.image_height + 45,
+                    ),
+                    fill="black",
+                    width=2,
+                )
+            elif train.direction == 2:
+                imageDrawer.line(
                     (
-                        train.position.x * self.image_width + 30,
-                        train.position.y * self.image_height + 30,
-                        train.position.x * self.image_width + 60,
-                        train.position.y * self.image_height + 60,
+                        train.position.x * self.image_width + 45,
+                        train.position.y * self.image_height + 45,
+                        train.position.x * self.image_width + 45,
+                        train.position.y * self.image_height + 75,
                     ),
-                    fill="red",
+                    fill="black",
+                    width=2,
+                )
+            elif train.direction == 3:
+                imageDrawer.line(
+                    (
+                        train.position.x * self.image_width + 45,
+                        train.position.y * self.image_height + 45,
+                        train.position.x * self.image_width + 15,
+                        train.position.y * self.image_height + 45,
+                    ),
+                    fill="black",
+                    width=2,
                 )
-                # draw direction arrow
-                if train.direction == 0:
-                    imageDrawer.line(
-                        (
-                            train.position.x * self.image_width + 45,
-                            train.position.y * self.image_height + 45,
-                            train.position.x * self.image_width + 45,
-                            train.position.y * self.image_height + 15,
-                        ),
-                        fill="black",
-                        width=2,
-                    )
-                elif train.direction == 1:
-                    imageDrawer.line(
-                        (
-                            train.position.x * self.image_width + 45,
-                            train.position.y * self.image_height + 45,
-                            train.position.x * self.image_width + 75,
-                            train.position.y * self.image_height + 45,
-                        ),
-                        fill="black",
-                        width=2,
-                    )
-                elif train.direction == 2:
-                    imageDrawer.line(
-                        (
-                            train.position.x * self.image_width + 45,
-                            train.position.y * self.image_height + 45,
-                            train.position.x * self.image_width + 45,
-                            train.position.y * self.image_height + 75,
-                        ),
-                        fill="black",
-                        width=2,
-                    )
-                elif train.direction == 3:
-                    imageDrawer.line(
-                        (
-                            train.position.x * self.image_width + 45,
-                            train.position.y * self.image_height + 45,
-                            train.position.x * self.image_width + 15,
-                            train.position.y * self.image_height + 45,
-                        ),
-                        fill="black",
-                        width=2,
-                    )
 
-        return image
+    def save(self, state: State, path: str, **kwargs) -> None:
+        self.draw(state, **kwargs).save(path)
+
+    def export_batch(self, items: Iterable[tuple[State, str]], **kwargs) -> None:
+        """Write one PNG per ``(state, path)`` pair, sharing cached backgrounds."""
+        for state, path in items:
+            self.save(state, path, **kwargs)
+
+    def export_gif(
+        self,
+        states: Iterable[State],
+        path: str,
+        duration: int = 200,
+        loop: int = 0,
+        **kwargs,
+    ) -> None:
+        """Write the states as the frames of an animated GIF."""
+        frames = [self.draw(state, **kwargs).convert("RGB") for state in states]
+        if not frames:
+            raise ValueError("No frames to export")
+        frames[0].save(
+            path,
+            save_all=True,
+            append_images=frames[1:],
+            duration=duration,
+            loop=loop,
+        )
 
 
 if __name__ == "__main__":
+    from level import make_state
+
     data = load_data("./src/levels/1-11.json")
-    grid = Grid(data["grid"])
     draw = Draw()
-    draw.draw(grid).show()
+    draw.draw(make_state(data), debug=True).show()
@@ -0,0 +1,231 @@
+"""Seeded generator of synthetic levels with a planted solution.
+
+A random self-avoiding route is walked from the start cell to the
+destination, optionally through tunnel pairs. The trains queue up nose to
+tail on the first cells of the route, the front one first in order, so they
+reach the destination one tick apart and never meet. Every route cell between
+the trains and the destination is left empty for the solver, and
+``max_tracks`` is the number of those cells, so the route itself is always a
+valid solution. Fences are scattered over the cells off the route.
+
+    python src/generator.py --width 8 --height 8 --trains 3 --tunnels 1 -o level.json
+"""
+
+import argparse
+import json
+import random
+from typing import Optional
+
+from tile import Direction, Position, Tile
+
+TRACK_TILES = [
+    Tile.STRAIGHT_H,
+    Tile.STRAIGHT_V,
+    Tile.CURVE_BL,
+    Tile.CURVE_BR,
+    Tile.CURVE_TL,
+    Tile.CURVE_TR,
+]
+TUNNEL_TILES = {
+    Direction.TOP: Tile.TUNNEL_T,
+    Direction.RIGHT: Tile.TUNNEL_R,
+    Direction.BOTTOM: Tile.TUNNEL_B,
+    Direction.LEFT: Tile.TUNNEL_L,
+}
+
+
+def track_tile(input_direction: Direction, output_direction: Direction) -> Tile:
+    for tile in TRACK_TILES:
+        if tile.get_output_direction(input_direction) == output_direction:
+            return tile
+    raise ValueError("No track turns back on itself")
+
+
+def _in_bounds(position: Position, width: int, height: int) -> bool:
+    return 0 <= position.x < width and 0 <= position.y < height
+
+
+def _walk(
+    rng: random.Random,
+    width: int,
+    height: int,
+    length: int,
+    trains: int,
+    tunnels: int,
+) -> Optional[list[tuple[Position, Direction, Optional[Tile]]]]:
+    """One attempt at a route, as (cell, direction of travel into it, tile).
+
+    The tile is only set for tunnels, the tracks follow from the directions.
+    """
+    start = Position(rng.randrange(width), rng.randrange(height))
+    direction = Direction(rng.randrange(4))
+    route = [(start, direction, None)]
+    used = {start}
+    # the back end of the start track must not touch the route later on
+    used.add(start - direction.delta)
+    tunnels_left = tunnels
+    while len(route) < length:
+        position, _, _ = route[-1]
+        # trains start on plain tracks, tunnels come after them
+        if tunnels_left and len(route) > trains and rng.random() < 0.3:
+            entrance = position + direction.delta
+            exits = [
+                (Position(x, y), exit_direction)
+                for x in range(width)
+                for y in range(height)
+                for exit_direction in Direction
+                if Position(x, y) not in used
+                and Position(x, y) != entrance
+                and _in_bounds(Position(x, y) + exit_direction.delta, width, height)
+                and Position(x, y) + exit_direction.delta not in used
+                and Position(x, y) + exit_direction.delta != entrance
+            ]
+            if _in_bounds(entrance, width, height) and entrance not in used and exits:
+                exit_position, exit_direction = rng.choice(exits)
+                route.append(
+                    (entrance, direction, TUNNEL_TILES[direction.opposite])
+                )
+                route.append((exit_position, direction, TUNNEL_TILES[exit_direction]))
+                used.update({entrance, exit_position})
+                direction = exit_direction
+                next_position = exit_position + direction.delta
+                route.append((next_position, direction, None))
+                used.add(next_position)
+                tunnels_left -= 1
+                continue
+
+        options = [
+            new_direction
+            for new_direction in Direction
+            if new_direction != direction.opposite
+            and _in_bounds(position + new_direction.delta, width, height)
+            and position + new_direction.delta not in used
+        ]
+        if not options:
+            return None
+        direction = rng.choice(options)
+        next_position = position + direction.delta
+        route.append((next_position, direction, None))
+        used.add(next_position)
+    if tunnels_left or route[-1][2] is not None:
+        return None
+    return route
+
+
+def generate_level(
+    width: int,
+    height: int,
+    trains: int = 1,
+    fence_density: float = 0.0,
+    tunnels: int = 0,
+    path_length: Optional[int] = None,
+    seed: Optional[int] = None,
+    attempts: int = 1000,
+) -> tuple[dict, list[list[int]]]:
+    """Return a level and the grid of its planted solution."""
+    if trains < 1:
+        raise ValueError("A level needs at least one train")
+    rng = random.Random(seed)
+    if path_length is None:
+        path_length = width + height
+    # trains, the tunnel cells and at least one free cell before the destination
+    path_length = max(path_length, trains + 3 * tunnels + 2)
+
+    for _ in range(attempts):
+        route = _walk(rng, width, height, path_length, trains, tunnels)
+        if route is None:
+            continue
+        route_cells = {position for position, _, _ in route}
+        destination, input_direction, _ = route[-1]
+        # the destination track must not point at another route cell
+        ends = [
+            output_direction
+            for output_direction in Direction
+            if output_direction != input_direction.opposite
+            and destination + output_direction.delta not in route_cells
+        ]
+        if not ends:
+            continue
+        break
+    else:
+        raise ValueError("Could not fit a route of this length on the board")
+
+    grid = [[int(Tile.EMPTY)] * width for _ in range(height)]
+    solution = [[int(Tile.EMPTY)] * width for _ in range(height)]
+    number_layer = [[0] * width for _ in range(height)]
+    tunnel_number = 0
+    for index, (position, direction, tile) in enumerate(route):
+        if tile is not None:
+            # an entrance always follows a track, its exit follows it
+            if route[index - 1][2] is None:
+                tunnel_number += 1
+            number_layer[position.y][position.x] = tunnel_number
+            grid[position.y][position.x] = int(tile)
+        else:
+            if index == len(route) - 1:
+                output_direction = rng.choice(ends)
+            else:
+                next_position = route[index + 1][0]
+                output_direction = Direction(
+                    [d for d in Direction if position + d.delta == next_position][0]
+                )
+            tile = track_tile(direction, output_direction)
+            # trains and the destination sit on fixed tracks
+            if index < trains or index == len(route) - 1:
+                grid[position.y][position.x] = int(tile)
+        solution[position.y][position.x] = int(tile)
+
+    for y in range(height):
+        for x in range(width):
+            if Position(x, y) not in route_cells and rng.random() < fence_density:
+                grid[y][x] = int(Tile.FENCE)
+                solution[y][x] = int(Tile.FENCE)
+
+    level = {
+        "grid": grid,
+        "numberLayer": number_layer,
+        "destination": [destination.x, destination.y],
+        "trains": [
+            {
+                "x": route[index][0].x,
+                "y": route[index][0].y,
+                "direction": int(route[index][1]),
+                # the train closest to the destination arrives first
+                "order": trains - index,
+            }
+            for index in range(trains)
+        ],
+        "max_tracks": sum(
+            1
+            for index, (_, _, tile) in enumerate(route)
+            if tile is None and trains <= index < len(route) - 1
+        ),
+    }
+    return level, solution
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic level")
+    parser.add_argument("--width", type=int, default=6)
+    parser.add_argument("--height", type=int, default=6)
+    parser.add_argument("--trains", type=int, default=1)
+    parser.add_argument("--fences", type=float, default=0.0)
+    parser.add_argument("--tunnels", type=int, default=0)
+    parser.add_argument("--length", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("-o", "--output", default=None)
+    args = parser.parse_args()
+    level, _ = generate_level(
+        args.width,
+        args.height,
+        args.trains,
+        args.fences,
+        args.tunnels,
+        args.length,
+        args.seed,
+    )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(level, file)
+    else:
+        print(json.dumps(level))
@@ -1,15 +1,15 @@
-import copy
 from dataclasses import dataclass
-from typing import Union, List
+from typing import Union, List, Optional
 import numpy as np
 from tile import Direction
-from collections import defaultdict
 
 
 @dataclass
 class Grid:
     data: Union[List[List[int]], np.ndarray]
-    flows: dict = None
+    # bit ``1 << direction`` is set for every direction a train entered a
+    # straight track with, used to pick the orientation of T-turns
+    flows: Optional[np.ndarray] = None
 
     def __post_init__(self):
         if isinstance(self.data, list):
@@ -24,11 +24,16 @@ class Grid:
             if self.data.ndim != 2:
                 raise ValueError("Input NumPy array must be 2D")
             self.height, self.width = self.data.shape
-            self.data = self.data.astype(int)
+            # copy=False: __copy__ and __deepcopy__ already hand over a copy
+            self.data = self.data.astype(int, copy=False)
         else:
             raise TypeError("Input must be either a 2D list or a NumPy array")
         if self.flows is None:
-            self.flows = defaultdict(lambda: defaultdict(bool))
+            self.flows = np.zeros(self.data.shape, dtype=np.uint8)
+        elif self.flows.shape != self.data.shape:
+            raise ValueError("Flows must have the same shape as the grid")
+        else:
+            self.flows = self.flows.astype(np.uint8, copy=False)
 
     def get(self, x: int, y: int) -> int:
         if 0 <= x < self.width and 0 <= y < self.height:
@@ -41,14 +46,15 @@ class Grid:
         else:
             raise IndexError("Coordinates out of bounds")
 
-    def get_flow(self, x: int, y: int) -> dict:
+    def get_flow(self, x: int, y: int) -> list[Direction]:
         if 0 <= x < self.width and 0 <= y < self.height:
-            return self.flows[(x, y)]
+            mask = int(self.flows[y, x])
+            return [direction for direction in Direction if mask & (1 << direction)]
         raise IndexError("Coordinates out of bounds")
 
     def add_flow(self, x: int, y: int, direction: Direction) -> None:
         if 0 <= x < self.width and 0 <= y < self.height:
-            self.flows[(x, y)][direction] = True
+            self.flows[y, x] |= 1 << direction
         else:
             raise IndexError("Coordinates out of bounds")
 
@@ -67,15 +73,10 @@ class Grid:
         return np.array_equal(self.data, other.data)
 
     def __copy__(self):
-        return Grid(np.copy(self.data), copy.copy(self.flows))
+        return Grid(np.copy(self.data), np.copy(self.flows))
 
     def __deepcopy__(self, memo):
-        flows = defaultdict(
-            lambda: defaultdict(bool),
-            {k: defaultdict(bool, v) for k, v in self.flows.items()},
-        )
-
-        return Grid(np.copy(self.data), flows)
+        return Grid(np.copy(self.data), np.copy(self.flows))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+"""Building the initial ``State`` of a level from its JSON data."""
+
+import copy
+from typing import Optional
+
+import numpy as np
+
+from grid import Grid
+from state import State, Train
+from tile import Direction, Position, Tile
+
+# tile budget of levels saved without max_tracks
+UNLIMITED_TRACKS = 10000
+
+
+def max_tracks(data: dict) -> int:
+    """Most tiles a solution of the level may place."""
+    return data.get("max_tracks", UNLIMITED_TRACKS)
+
+
+def make_effects(data):
+    if "numberLayer" not in data:
+        # levels without tunnels are saved without the number layer
+        return {}
+    grid = np.array(data["grid"])
+    numberLayer = np.array(data["numberLayer"])
+    effects: Optional[dict[Position, tuple[str, any]]] = {}
+    for x in range(grid.shape[1]):
+        for y in range(grid.shape[0]):
+            tile = Tile(grid[y, x])
+            if tile.is_tunnel:
+                other_tunnel = None
+                for x2 in range(grid.shape[1]):
+                    for y2 in range(grid.shape[0]):
+                        if (x2 != x or y2 != y) and (
+                            numberLayer[y2, x2] == numberLayer[y, x]
+                        ):
+                            other_tunnel = (x2, y2, Tile(grid[y2, x2]))
+                            break
+                    if other_tunnel:
+                        break
+
+                if other_tunnel:
+                    direction = other_tunnel[-1].name.split("_")[-1]
+                    direction = "TRBL".index(direction)
+                    effects[Position(x, y)] = (
+                        "tunnel",
+                        other_tunnel[:2],
+                        Direction(direction),
+                    )
+    return effects
+
+
+def make_state(data: dict, grid: Optional[Grid] = None) -> State:
+    """Initial state of a level, optionally on an already solved ``grid``."""
+    trains = [
+        Train(
+            Position(train["x"], train["y"]),
+            train["direction"],
+            train["order"],
+        )
+        for train in data["trains"]
+    ]
+    effects = make_effects(data)
+    level_grid = Grid(data["grid"])
+    state = State(
+        grid=level_grid,
+        trains=trains,
+        destination=Position(*data["destination"]),
+        effects=effects,
+    )
+    if grid is not None:
+        # keep the level's own tiles immutable, the rest were placed on it
+        state.grid = copy.deepcopy(grid)
+    return state
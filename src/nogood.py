@@ -0,0 +1,57 @@
+from collections import defaultdict
+from typing import Optional
+
+from state import State
+from tile import Position, Tile
+
+
+class NogoodStore:
+    """Placed tiles that are known to make the trains fail.
+
+    Simulating is deterministic, so the outcome of ``State.simulate`` only
+    depends on the trains it starts from and the tiles on the cells the
+    trains visit. A failure is stored as the placed tiles on those cells,
+    indexed by the starting train configuration, and any other state that
+    starts from the same trains and has the same tiles there fails too.
+    """
+
+    def __init__(self) -> None:
+        self.patterns: dict[tuple, list[tuple[tuple[Position, Tile], ...]]] = (
+            defaultdict(list)
+        )
+        self.size = 0
+        # states rejected because they contain a nogood
+        self.pruned = 0
+
+    @staticmethod
+    def key(state: State) -> tuple:
+        return (
+            state.order_counter,
+            tuple((train.position, train.direction) for train in state.trains),
+        )
+
+    def add(self, key: tuple, state: State, visited: set[Position]) -> None:
+        # immutable tiles are the same in every state, only placed ones matter
+        pattern = tuple(
+            sorted(
+                (position, Tile(state.grid.get(*position)))
+                for position in visited
+                if position not in state.immutable_positions
+            )
+        )
+        patterns = self.patterns[key]
+        if any(set(known) <= set(pattern) for known in patterns):
+            return
+        patterns.append(pattern)
+        self.size += 1
+
+    def matches(self, state: State, key: Optional[tuple] = None) -> bool:
+        if key is None:
+            key = self.key(state)
+        patterns = self.patterns.get(key)
+        if not patterns:
+            return False
+        return any(
+            all(state.grid.get(*position) == tile for position, tile in pattern)
+            for pattern in patterns
+        )
@@ -0,0 +1,135 @@
+"""Child ordering for the search in ``solve``.
+
+An ordering sorts the children of an expanded state so the most promising
+one is explored first. With DFS this decides where the first dive goes, and
+an early solution tightens the tile bound that prunes the rest of the tree.
+
+    solve(data, "dfs", ordering="toward_destination")
+"""
+
+from collections import defaultdict
+
+from state import State
+from tile import Direction, Position, Tile
+
+
+class ChildOrdering:
+    """Sorts children by ``score``, lower first. Ties keep the placement order."""
+
+    def order(
+        self, children: list[State], empty_positions: list[tuple[Position, Direction]]
+    ) -> list[State]:
+        return sorted(children, key=lambda child: self.score(child, empty_positions))
+
+    def score(
+        self, child: State, empty_positions: list[tuple[Position, Direction]]
+    ) -> float:
+        return 0
+
+    def update(self, state: State, result: tuple) -> None:
+        """Called with the outcome of every simulated state."""
+
+    def take_changes(self) -> dict:
+        """What ``update`` learned since the last call, for checkpoint deltas."""
+        return {}
+
+    def apply_changes(self, changes: dict) -> None:
+        """Replay the output of ``take_changes`` on a restored ordering."""
+
+
+class TowardDestination(ChildOrdering):
+    """Prefer tiles that send the trains closer to the destination."""
+
+    def score(self, child, empty_positions):
+        distance = 0
+        for position, direction in empty_positions:
+            tile = Tile(child.grid.get(*position))
+            output_direction = tile.get_output_direction(direction)
+            if output_direction == -1:
+                return float("inf")
+            next_position = position + output_direction.delta
+            distance += abs(next_position.x - child.destination.x) + abs(
+                next_position.y - child.destination.y
+            )
+        return distance
+
+
+class FewestOpenEnds(ChildOrdering):
+    """Prefer tiles that leave the fewest track ends pointing at nothing."""
+
+    def score(self, child, empty_positions):
+        grid = child.grid
+        open_ends = 0
+        for position in {position for position, _ in empty_positions}:
+            connection = Tile(grid.get(*position)).get_connection_direction()
+            for direction in Direction:
+                if not connection[direction]:
+                    continue
+                adjacent_pos = position + direction.delta
+                if not (
+                    0 <= adjacent_pos.x < grid.width
+                    and 0 <= adjacent_pos.y < grid.height
+                ) or grid.get(*adjacent_pos) == Tile.EMPTY:
+                    open_ends += 1
+        return open_ends
+
+
+class HistoryHeuristic(ChildOrdering):
+    """Prefer (cell, tile) placements that worked out earlier in the search.
+
+    Every placed tile of a solution is rewarded, the tiles placed last in a
+    state that survives a simulation gain a little and those of a state that
+    fails lose a little.
+    """
+
+    SUCCESS_REWARD = 10
+    SURVIVE_REWARD = 1
+    FAILURE_PENALTY = 1
+
+    def __init__(self) -> None:
+        self.history: dict[tuple[Position, Tile], int] = defaultdict(int)
+        # keys updated since ``take_changes`` was last called
+        self.changed: set[tuple[Position, Tile]] = set()
+
+    def score(self, child, empty_positions):
+        return -sum(
+            self.history[(position, Tile(child.grid.get(*position)))]
+            for position, _ in empty_positions
+        )
+
+    def update(self, state, result):
+        if result[0] == "success":
+            grid = state.grid
+            for y, x in zip(*grid.data.nonzero()):
+                position = Position(int(x), int(y))
+                if position not in state.immutable_positions:
+                    key = (position, Tile(grid.get(*position)))
+                    self.history[key] += self.SUCCESS_REWARD
+                    self.changed.add(key)
+            return
+        if not state.last_placed:
+            return
+        change = (
+            self.SURVIVE_REWARD
+            if result[0] == "empty_pos_reached"
+            else -self.FAILURE_PENALTY
+        )
+        for position in state.last_placed:
+            key = (position, Tile(state.grid.get(*position)))
+            self.history[key] += change
+            self.changed.add(key)
+
+    def take_changes(self):
+        changes = {key: self.history[key] for key in self.changed}
+        self.changed = set()
+        return changes
+
+    def apply_changes(self, changes):
+        self.history.update(changes)
+
+
+ORDERINGS = {
+    "toward_destination": TowardDestination,
+    "fewest_open_ends": FewestOpenEnds,
+    "history": HistoryHeuristic,
+}
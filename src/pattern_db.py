@@ -0,0 +1,240 @@
+"""Lower bounds on the tiles a state still needs.
+
+``build_table`` runs a shortest path search backwards from the destination
+over (cell, direction) pairs. The result says, for a train that stands on a
+cell and entered it moving in a direction, how many free cells it must at
+least pass before it arrives. Fixed tiles and tunnels are followed as they
+are, fences and the board edge are walls, and a free cell may turn the train
+any way but back.
+
+``tiles_lower_bound`` adds the empty cells left on the cheapest route of
+the furthest train to the tiles a state has already placed. Filled cells
+cost nothing, so the route is searched forwards on the state's own grid.
+A filled cell saves at most one tile against the table, so the table
+decides cheaply which states are worth that search. The routes are not
+summed, because trains share tracks.
+
+The table only depends on the level, so it is built once per process and
+can be saved with the level file under ``"patternDatabase"``:
+
+    python src/pattern_db.py ./src/levels/*.json
+"""
+
+import hashlib
+import json
+import sys
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
+
+from state import State
+from tile import Direction, Position, Tile
+
+UNREACHABLE = 10**6
+
+Node = tuple[Position, Direction]
+
+# where a placed T-turn sends a train, by tile value and direction
+_T_TURN_OUTPUTS = {
+    (int(tile), direction): tile.get_output_direction(direction)
+    for tile in Tile
+    if tile.is_t_turn
+    for direction in Direction
+}
+
+
+@dataclass
+class PatternDatabase:
+    table: np.ndarray
+    # the moves ``build_table`` searched, inside the board and off fences
+    successors: dict[Node, list[Node]]
+
+
+# databases already built, by level key
+_databases: dict[str, PatternDatabase] = {}
+
+
+def _level_key(data: dict) -> str:
+    level = {key: data.get(key) for key in ("grid", "numberLayer", "destination")}
+    return hashlib.sha1(json.dumps(level, sort_keys=True).encode()).hexdigest()
+
+
+def _successors(state: State, position: Position, direction: Direction) -> list[Node]:
+    """Where a train on ``position`` that entered it moving ``direction`` can go."""
+    if position in state.effects:
+        _, exit_position, exit_direction = state.effects[position]
+        return [(Position(*exit_position) + exit_direction.delta, exit_direction)]
+    if position in state.immutable_positions:
+        output_direction = Tile(state.grid.get(*position)).get_output_direction(
+            direction
+        )
+        if output_direction == -1:
+            return []
+        return [(position + output_direction.delta, output_direction)]
+    return [
+        (position + output_direction.delta, output_direction)
+        for output_direction in Direction
+        if output_direction != direction.opposite
+    ]
+
+
+def build_successors(state: State) -> dict[Node, list[Node]]:
+    grid = state.grid
+    successors: dict[Node, list[Node]] = {}
+    for x in range(grid.width):
+        for y in range(grid.height):
+            position = Position(x, y)
+            if position == state.destination or grid.get(x, y) == Tile.FENCE:
+                continue
+            for direction in Direction:
+                successors[(position, direction)] = [
+                    (next_position, next_direction)
+                    for next_position, next_direction in _successors(
+                        state, position, direction
+                    )
+                    if 0 <= next_position.x < grid.width
+                    and 0 <= next_position.y < grid.height
+                    and grid.get(*next_position) != Tile.FENCE
+                ]
+    return successors
+
+
+def build_table(state: State, successors: dict[Node, list[Node]]) -> np.ndarray:
+    """Minimum free cells to the destination, indexed ``[y, x, direction]``."""
+    grid = state.grid
+    table = np.full((grid.height, grid.width, 4), UNREACHABLE, dtype=np.int32)
+    # edges reversed, so the search can start from the destination
+    predecessors: dict[Node, list] = {}
+    for node, next_nodes in successors.items():
+        for next_node in next_nodes:
+            next_position = next_node[0]
+            cost = int(
+                next_position != state.destination
+                and next_position not in state.immutable_positions
+            )
+            predecessors.setdefault(next_node, []).append((node, cost))
+
+    # 0-1 BFS: free cells cost one, fixed ones nothing
+    queue = deque()
+    for direction in Direction:
+        table[state.destination.y, state.destination.x, direction] = 0
+        queue.append((state.destination, direction))
+    while queue:
+        node = queue.popleft()
+        distance = table[node[0].y, node[0].x, node[1]]
+        for (position, direction), cost in predecessors.get(node, []):
+            if distance + cost < table[position.y, position.x, direction]:
+                table[position.y, position.x, direction] = distance + cost
+                if cost:
+                    queue.append((position, direction))
+                else:
+                    queue.appendleft((position, direction))
+    return table
+
+
+def pattern_database(data: dict, state: State, store: bool = False) -> PatternDatabase:
+    """The database of the level ``data``, built once per process.
+
+    A table saved in ``data`` is used when it still matches the level. With
+    ``store`` the table is written into ``data`` so it can be saved.
+    """
+    key = _level_key(data)
+    if key not in _databases:
+        successors = build_successors(state)
+        stored = data.get("patternDatabase")
+        if stored is not None and stored["key"] == key:
+            table = np.array(stored["table"], dtype=np.int32)
+        else:
+            table = build_table(state, successors)
+        _databases[key] = PatternDatabase(table, successors)
+    if store:
+        data["patternDatabase"] = {"key": key, "table": _databases[key].table.tolist()}
+    return _databases[key]
+
+
+def _route_cost(
+    database: PatternDatabase, state: State, start: Node, budget: int
+) -> int:
+    """Fewest empty cells on a route to the destination, ``budget + 1`` if more."""
+    cells = state.grid.data.tolist()
+    distances = {start: 0}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        position, direction = node
+        distance = distances[node]
+        if position == state.destination:
+            return distance
+        successors = database.successors[node]
+        if position not in state.immutable_positions:
+            # a placed curve or straight may still be turned into a T-turn by
+            # State._repair_placement, so only placed T-turns are followed as
+            # they are
+            output_direction = _T_TURN_OUTPUTS.get(
+                (cells[position.y][position.x], direction)
+            )
+            if output_direction == -1:
+                continue
+            if output_direction is not None:
+                successors = [
+                    next_node
+                    for next_node in successors
+                    if next_node[1] == output_direction
+                ]
+        for next_node in successors:
+            next_position = next_node[0]
+            cost = int(
+                cells[next_position.y][next_position.x] == Tile.EMPTY
+                and next_position != state.destination
+            )
+            next_distance = distance + cost
+            if next_distance > budget or next_distance >= distances.get(
+                next_node, UNREACHABLE
+            ):
+                continue
+            distances[next_node] = next_distance
+            if cost:
+                queue.append(next_node)
+            else:
+                queue.appendleft(next_node)
+    return budget + 1
+
+
+def tiles_lower_bound(
+    database: PatternDatabase, state: State, limit: int = UNREACHABLE
+) -> int:
+    """Tiles any solution below ``state`` places, ``limit + 1`` once past it."""
+    trains = [train for train in state.trains if train.position != state.destination]
+    # every filled cell on a route saves at most one tile of the table entry,
+    # so the table alone is a bound and routes are only searched when the
+    # entry could prune
+    table_bound = max(
+        (
+            int(database.table[train.position.y, train.position.x, train.direction])
+            for train in trains
+        ),
+        default=0,
+    )
+    bound = max(state.placed_tiles, table_bound)
+    if state.placed_tiles + table_bound <= limit:
+        return bound
+    budget = limit - state.placed_tiles
+    for train in trains:
+        cost = _route_cost(database, state, (train.position, train.direction), budget)
+        bound = max(bound, state.placed_tiles + cost)
+        if cost > budget:
+            break
+    return bound
+
+
+if __name__ == "__main__":
+    from level import make_state
+
+    for path in sys.argv[1:]:
+        with open(path) as file:
+            data = json.load(file)
+        pattern_database(data, make_state(data), store=True)
+        with open(path, "w") as file:
+            json.dump(data, file)
+        print(f"Stored the pattern database of {path}")
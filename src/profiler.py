@@ -0,0 +1,217 @@
+"""Low overhead sampling profiler for solves and batch runs.
+
+A daemon thread wakes every ``interval_s`` and, when the process used CPU
+time since the last wake, counts the code objects on the stack of every
+other thread, so the tiny hot functions are not slowed down the way
+``cProfile`` slows them. The sampler needs the GIL to run, so a busy thread
+is sampled at most every ``sys.getswitchinterval()``.
+
+Stacks are kept under their thread name, so a solve in an executor thread
+such as the one ``async_solver`` uses is profiled as well as one on the
+main thread. Threads waiting on a lock, a queue or a selector are skipped.
+Solves in other processes, such as the ``server`` pool or ``distributed``
+workers, are not seen: start the profiler in that process.
+
+Each level gets its own file, either collapsed stacks for ``flamegraph.pl``
+and most flamegraph viewers, or a speedscope profile:
+
+    python src/profiler.py ./src/levels/*.json --method dfs --out profiles
+    python src/profiler.py ./src/levels/2-4.json --format collapsed
+
+    with SamplingProfiler() as profiler:
+        solve(data)
+    profiler.write("2-4.speedscope.json")
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType
+from typing import Optional, Union
+
+FORMATS = {"collapsed": ".collapsed", "speedscope": ".speedscope.json"}
+
+# a thread stopped in one of these modules is waiting, not running
+IDLE_FILES = tuple(
+    os.path.join(*path)
+    for path in [
+        ("threading.py",),
+        ("queue.py",),
+        ("selectors.py",),
+        ("concurrent", "futures", "thread.py"),
+        ("concurrent", "futures", "_base.py"),
+    ]
+)
+
+
+def _frame_name(code: CodeType) -> str:
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval_s: float = 0.001, name: str = "solve") -> None:
+        self.interval_s = interval_s
+        self.name = name
+        # stacks are stored root first, as the thread name and code objects
+        self.samples: Counter[tuple] = Counter()
+        self.cpu_time = 0.0
+        self._start_time = 0.0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == threading.get_ident() or frame.f_code.co_filename.endswith(
+                IDLE_FILES
+            ):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack.append(names.get(ident, f"Thread-{ident}"))
+            stack.reverse()
+            self.samples[tuple(stack)] += 1
+
+    def _run(self) -> None:
+        cpu_time = time.process_time()
+        while not self._stopped.wait(self.interval_s):
+            previous, cpu_time = cpu_time, time.process_time()
+            if cpu_time > previous:
+                self._sample()
+
+    def start(self) -> None:
+        self._start_time = time.process_time()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="SamplingProfiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self.cpu_time += time.process_time() - self._start_time
+
+    def __enter__(self) -> "SamplingProfiler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def collapsed(self) -> str:
+        return "".join(
+            ";".join([stack[0], *(_frame_name(code) for code in stack[1:])])
+            + f" {count}\n"
+            for stack, count in self.samples.most_common()
+        )
+
+    def speedscope(self) -> dict:
+        frames: dict[Union[str, CodeType], int] = {}
+        samples = []
+        weights = []
+        # samples are taken at the GIL switch interval at best, so the real
+        # time per sample comes from the CPU time measured around the run
+        sample_time = self.cpu_time / max(1, sum(self.samples.values()))
+        for stack, count in self.samples.items():
+            samples.append([frames.setdefault(code, len(frames)) for code in stack])
+            weights.append(count * sample_time)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {
+                "frames": [
+                    (
+                        {"name": code}
+                        if isinstance(code, str)
+                        else {
+                            "name": code.co_name,
+                            "file": code.co_filename,
+                            "line": code.co_firstlineno,
+                        }
+                    )
+                    for code in frames
+                ]
+            },
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": self.name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+            "name": self.name,
+            "exporter": "railbound-solver",
+        }
+
+    def write(self, path: str, format: Optional[str] = None) -> None:
+        """Write the profile, in the format that matches the file name by default."""
+        if format is None:
+            format = "collapsed" if path.endswith(".collapsed") else "speedscope"
+        if format not in FORMATS:
+            raise ValueError("Invalid profile format")
+        with open(path, "w") as file:
+            if format == "collapsed":
+                file.write(self.collapsed())
+            else:
+                json.dump(self.speedscope(), file)
+
+
+def profile_levels(
+    paths: list[str],
+    out_dir: str = "profiles",
+    format: str = "speedscope",
+    interval_s: float = 0.001,
+    method: str = "bfs",
+    **limits,
+) -> dict[str, str]:
+    """Solve every level under the profiler, one profile file per level."""
+    from solver import solve
+    from utils import load_data
+
+    if format not in FORMATS:
+        raise ValueError("Invalid profile format")
+    os.makedirs(out_dir, exist_ok=True)
+    written = {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        data = load_data(path)
+        with SamplingProfiler(interval_s, name) as profiler:
+            solution = solve(data, method, **limits)
+        output = os.path.join(out_dir, name + FORMATS[format])
+        profiler.write(output, format)
+        written[path] = output
+        print(
+            f"{name}: {solution['status']} in {solution['time']:.2f}s,"
+            f" {sum(profiler.samples.values())} samples -> {output}"
+        )
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the solver by sampling")
+    parser.add_argument("levels", nargs="+")
+    parser.add_argument("--method", default="bfs")
+    parser.add_argument("--format", choices=list(FORMATS), default="speedscope")
+    parser.add_argument("--out", default="profiles")
+    parser.add_argument("--interval", type=float, default=0.001)
+    parser.add_argument("--deadline", type=float, default=None)
+    args = parser.parse_args()
+    profile_levels(
+        args.levels,
+        args.out,
+        args.format,
+        args.interval,
+        args.method,
+        deadline_s=args.deadline,
+    )
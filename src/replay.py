@@ -0,0 +1,168 @@
+"""Replay a solved level tick by tick and export it as an animation.
+
+The static parts of every frame come from one base frame of the solved grid;
+each tick only repaints the cells a train left or entered. Frames are handed
+to the writer as soon as they are drawn, so memory stays flat however long
+the run is.
+
+    python src/replay.py ./src/levels/2-4.json replay.gif
+"""
+
+import copy
+import sys
+from typing import Iterator, Optional, Union
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, GifImagePlugin
+
+from draw import Draw
+from grid import Grid
+from solver import drawer as default_drawer, make_state, solve
+from state import State, Train
+from tile import Position
+from utils import load_data
+
+
+def replay(state: State, max_ticks: Optional[int] = None) -> Iterator[list[Train]]:
+    """Yield the trains at the start and after every tick of ``state``."""
+    state = copy.deepcopy(state)
+    yield copy.deepcopy(state.trains)
+    for _ in range(max_ticks or state.max_steps):
+        result = state.step()
+        yield copy.deepcopy(state.trains)
+        if result is not None:
+            return
+
+
+class GifWriter:
+    """Animated GIF written frame by frame, only storing the changed region."""
+
+    def __init__(self, path: str, duration: int = 300, loop: int = 0) -> None:
+        self.fp = open(path, "wb")
+        self.duration = duration
+        self.loop = loop
+        self.palette = None
+
+    def write(self, frame: Image.Image, box: tuple[int, int, int, int]) -> None:
+        if self.palette is None:
+            self.palette = frame.convert("RGB").quantize(dither=Image.Dither.NONE)
+            header, _ = GifImagePlugin.getheader(
+                self.palette, info={"loop": self.loop, "duration": self.duration}
+            )
+            self._write_chunks(header)
+            image, offset = self.palette, (0, 0)
+        else:
+            image = (
+                frame.crop(box)
+                .convert("RGB")
+                .quantize(palette=self.palette, dither=Image.Dither.NONE)
+            )
+            offset = box[:2]
+        # disposal 1 keeps the previous frame under the updated region
+        self._write_chunks(
+            GifImagePlugin.getdata(
+                image, offset, duration=self.duration, disposal=1
+            )
+        )
+
+    def _write_chunks(self, chunks) -> None:
+        for chunk in chunks:
+            self.fp.write(chunk)
+
+    def close(self) -> None:
+        self.fp.write(b";")
+        self.fp.close()
+
+
+class Mp4Writer:
+    def __init__(self, path: str, size: tuple[int, int], fps: float = 3) -> None:
+        self.writer = cv2.VideoWriter(
+            path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size
+        )
+
+    def write(self, frame: Image.Image, box: tuple[int, int, int, int]) -> None:
+        self.writer.write(cv2.cvtColor(np.array(frame), cv2.COLOR_RGBA2BGR))
+
+    def close(self) -> None:
+        self.writer.release()
+
+
+def render_frames(
+    drawer: Draw, state: State, max_ticks: Optional[int] = None
+) -> Iterator[tuple[Image.Image, tuple[int, int, int, int]]]:
+    """Yield the frame and the bounding box of the cells changed since the last one.
+
+    The same image object is updated and yielded every tick.
+    """
+    base = drawer.draw(state)
+    frame = base.copy()
+    imageDrawer = ImageDraw.Draw(frame)
+    previous_cells: set[Position] = set()
+    for trains in replay(state, max_ticks):
+        cells = {
+            train.position
+            for train in trains
+            if 0 <= train.position.x < state.grid.width
+            and 0 <= train.position.y < state.grid.height
+        }
+        dirty = cells | previous_cells
+        for position in dirty:
+            box = _cell_box(drawer, position)
+            frame.paste(base.crop(box), box[:2])
+        drawer.draw_trains(
+            imageDrawer, [train for train in trains if train.position in cells]
+        )
+        if previous_cells:
+            boxes = [_cell_box(drawer, position) for position in dirty]
+            box = (
+                min(b[0] for b in boxes),
+                min(b[1] for b in boxes),
+                max(b[2] for b in boxes),
+                max(b[3] for b in boxes),
+            )
+        else:
+            box = (0, 0) + frame.size
+        previous_cells = cells
+        yield frame, box
+
+
+def _cell_box(drawer: Draw, position: Position) -> tuple[int, int, int, int]:
+    x = position.x * drawer.image_width
+    y = position.y * drawer.image_height
+    return (x, y, x + drawer.image_width, y + drawer.image_height)
+
+
+def export_replay(
+    data: dict,
+    grid: Union[Grid, list],
+    path: str,
+    duration: int = 300,
+    max_ticks: Optional[int] = None,
+    drawer: Draw = None,
+) -> None:
+    """Write the run of ``data`` on the solved ``grid`` to a ``.gif`` or ``.mp4``."""
+    if not isinstance(grid, Grid):
+        grid = Grid(grid)
+    drawer = drawer or default_drawer
+    state = make_state(data, grid)
+    if path.endswith(".mp4"):
+        size = (grid.width * drawer.image_width, grid.height * drawer.image_height)
+        writer = Mp4Writer(path, size, fps=1000 / duration)
+    elif path.endswith(".gif"):
+        writer = GifWriter(path, duration)
+    else:
+        raise ValueError("Replay can only be exported to .gif or .mp4")
+    try:
+        for frame, box in render_frames(drawer, state, max_ticks):
+            writer.write(frame, box)
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    data = load_data(sys.argv[1])
+    solution = solve(data, "bfs")
+    if solution["best_solution"] is None:
+        sys.exit("No solution found")
+    export_replay(data, solution["best_solution"].grid, sys.argv[2])
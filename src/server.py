@@ -0,0 +1,257 @@
+"""Long-running local solver service.
+
+Starting a fresh process per solve pays for importing numpy/cv2/PIL, building
+``TILES_CONNECT`` and loading the tile images every time. The service keeps a
+pool of warm worker processes instead, groups requests that arrive close
+together into batches, spreads each batch over the workers in as few round
+trips as possible and shares a solution cache between all clients.
+
+    python src/server.py --port 8765 --workers 4
+
+    curl -X POST localhost:8765/solve -d '{"level": {...}, "method": "bfs"}'
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+LIMIT_KEYS = ("deadline_s", "max_nodes", "max_memory_mb")
+
+
+def _warm_up():
+    # Importing the solver builds TILES_CONNECT and the drawer once per worker
+    import solver  # noqa: F401
+
+
+def serialize_solution(solution: dict) -> dict:
+    best_solution = solution["best_solution"]
+    return {
+        "status": solution["status"],
+        "iteration": solution["iteration"],
+        "lower_bound": solution["lower_bound"],
+        "gap": solution["gap"],
+        "time": solution["time"],
+        "placed_tiles": (
+            best_solution.placed_tiles if best_solution is not None else None
+        ),
+        "grid": (
+            best_solution.grid.data.tolist() if best_solution is not None else None
+        ),
+    }
+
+
+def _solve_batch(jobs: list[tuple[dict, str, dict]]) -> list[dict]:
+    from solver import solve
+
+    results = []
+    for data, method, limits in jobs:
+        try:
+            results.append(serialize_solution(solve(data, method, **limits)))
+        except Exception as e:
+            results.append({"status": "error", "error": str(e)})
+    return results
+
+
+def cache_key(data: dict, method: str, limits: dict) -> str:
+    payload = json.dumps([data, method, limits], sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class SolverService:
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        batch_size: int = 16,
+        batch_window_s: float = 0.002,
+        cache_size: int = 1024,
+    ) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_warm_up
+        )
+        # start every worker now so the first requests do not pay for imports
+        for future in [self.pool.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+        self.batch_size = batch_size
+        self.batch_window_s = batch_window_s
+        # least recently used solutions, at most ``cache_size`` of them
+        self.cache: OrderedDict[str, dict] = OrderedDict()
+        self.cache_size = cache_size
+        self.in_flight: dict[str, Future] = {}
+        self.stats = {"requests": 0, "cache_hits": 0, "batches": 0, "solved": 0}
+        self._lock = threading.Lock()
+        self._pending: queue.Queue = queue.Queue()
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, data: dict, method: str = "bfs", **limits) -> Future:
+        if method not in ["bfs", "dfs", "cp"]:
+            raise ValueError("Invalid method")
+        limits = {k: v for k, v in limits.items() if v is not None}
+        key = cache_key(data, method, limits)
+        with self._lock:
+            self.stats["requests"] += 1
+            if key in self.cache:
+                self.stats["cache_hits"] += 1
+                self.cache.move_to_end(key)
+                future = Future()
+                future.set_result(self.cache[key])
+                return future
+            # identical requests in flight share one solve
+            if key in self.in_flight:
+                self.stats["cache_hits"] += 1
+                return self.in_flight[key]
+            future = Future()
+            self.in_flight[key] = future
+        self._pending.put((key, data, method, limits))
+        return future
+
+    def solve(self, data: dict, method: str = "bfs", **limits) -> dict:
+        return self.submit(data, method, **limits).result()
+
+    def _dispatch(self):
+        while True:
+            first = self._pending.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.perf_counter() + self.batch_window_s
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._pending.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._pending.put(None)
+                    break
+                batch.append(item)
+            with self._lock:
+                self.stats["batches"] += 1
+            # one chunk per worker, so the batch is solved in parallel and only
+            # many small requests share a round trip
+            chunk_size = math.ceil(len(batch) / self.workers)
+            for start in range(0, len(batch), chunk_size):
+                chunk = batch[start : start + chunk_size]
+                jobs = [(data, method, limits) for _, data, method, limits in chunk]
+                pool_future = self.pool.submit(_solve_batch, jobs)
+                pool_future.add_done_callback(
+                    lambda f, keys=[item[0] for item in chunk]: self._finish(keys, f)
+                )
+
+    def _finish(self, keys: list[str], pool_future: Future):
+        try:
+            results = pool_future.result()
+        except Exception as e:
+            results = [{"status": "error", "error": str(e)}] * len(keys)
+        for key, result in zip(keys, results):
+            with self._lock:
+                future = self.in_flight.pop(key)
+                self.stats["solved"] += 1
+                # limited searches depend on timing, only exhaustive ones are reusable
+                if result["status"] == "complete":
+                    self.cache[key] = result
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+            future.set_result(result)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._pending.put(None)
+        self._dispatcher.join()
+        self.pool.shutdown()
+
+
+def make_handler(service: SolverService):
+    class SolverRequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, code: int, payload) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                with service._lock:
+                    stats = dict(service.stats, cached=len(service.cache))
+                self._send_json(200, stats)
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/solve":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                if not isinstance(request, dict):
+                    raise ValueError("The request must be a JSON object")
+                if not isinstance(request.get("level"), dict):
+                    raise ValueError("The level must be a JSON object")
+                limits = {k: request.get(k) for k in LIMIT_KEYS}
+                for name, value in limits.items():
+                    if value is not None and not isinstance(value, (int, float)):
+                        raise ValueError(f"{name} must be a number")
+                future = service.submit(
+                    request["level"], request.get("method", "bfs"), **limits
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            result = future.result()
+            # the solver raised on this level, most likely a malformed one
+            self._send_json(422 if result["status"] == "error" else 200, result)
+
+        def log_message(self, format, *args):
+            pass
+
+    return SolverRequestHandler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, **service_options):
+    service = SolverService(**service_options)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Solver service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Railbound solver service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--batch-window", type=float, default=0.002)
+    parser.add_argument("--cache-size", type=int, default=1024)
+    args = parser.parse_args()
+    serve(
+        args.host,
+        args.port,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        batch_window_s=args.batch_window,
+        cache_size=args.cache_size,
+    )
@@ -1,136 +1,360 @@
+import json
 import os
 import re
+import threading
 import time
 from collections import deque
 
 import cv2
 import numpy as np
 
+from checkpoint import CheckpointWriter, load_checkpoint
 from draw import Draw
-from grid import Grid
-from tile import Position, Tile, Direction
-from utils import load_data
-from state import State, Train
-from typing import Optional
+from cp_solver import solve_cp
+from level import make_effects, make_state, max_tracks
+from nogood import NogoodStore
+from ordering import ORDERINGS, ChildOrdering
+from pattern_db import pattern_database, tiles_lower_bound
+from utils import load_data, memory_usage_mb
+from verify import SOLUTIONS_PATH
+from state import State
+from typing import Callable, Optional, Union
 
 drawer = Draw()
 
+# Reading the process memory is a syscall, so only do it every so often.
+MEMORY_CHECK_INTERVAL = 256
 
-def make_effects(data):
-    grid = np.array(data["grid"])
-    numberLayer = np.array(data["numberLayer"])
-    effects: Optional[dict[Position, tuple[str, any]]] = {}
-    for x in range(grid.shape[1]):
-        for y in range(grid.shape[0]):
-            tile = Tile(grid[y, x])
-            if tile.is_tunnel:
-                other_tunnel = None
-                for x2 in range(grid.shape[1]):
-                    for y2 in range(grid.shape[0]):
-                        if (x2 != x or y2 != y) and (
-                            numberLayer[y2, x2] == numberLayer[y, x]
-                        ):
-                            other_tunnel = (x2, y2, Tile(grid[y2, x2]))
-                            break
-                    if other_tunnel:
-                        break
-
-                if other_tunnel:
-                    direction = other_tunnel[-1].name.split("_")[-1]
-                    direction = "TRBL".index(direction)
-                    effects[Position(x, y)] = (
-                        "tunnel",
-                        other_tunnel[:2],
-                        Direction(direction),
-                    )
-    return effects
 
+def solve(
+    data: dict,
+    method: str = "bfs",
+    deadline_s: Optional[float] = None,
+    max_nodes: Optional[int] = None,
+    max_memory_mb: Optional[float] = None,
+    cancel: Optional[threading.Event] = None,
+    on_progress: Optional[Callable[[dict], None]] = None,
+    progress_interval: int = 1000,
+    learn_nogoods: Optional[bool] = None,
+    ordering: Union[str, ChildOrdering, None] = None,
+    checkpoint: Optional[str] = None,
+    checkpoint_interval: int = 10000,
+    resume: Optional[str] = None,
+    start: Optional[State] = None,
+    use_pattern_db: Optional[bool] = None,
+):
+    """Search for the solution with the fewest placed tiles.
+
+    ``method`` is ``"bfs"`` or ``"dfs"`` for the search driven by the train
+    simulation, or ``"cp"`` for the constraint propagation backend in
+    ``cp_solver``.
+
+    The search is anytime: when ``deadline_s`` (wall clock seconds),
+    ``max_nodes`` (expanded states) or ``max_memory_mb`` (resident memory)
+    is hit, the best solution found so far is returned together with a
+    proven lower bound on the number of placed tiles and the gap between
+    the two. ``status`` is ``"complete"`` when the search space was
+    exhausted, otherwise the name of the limit that stopped it.
+
+    Setting ``cancel`` from another thread stops the search with status
+    ``"cancelled"``. ``on_progress`` is called every ``progress_interval``
+    iterations with the iteration count, frontier size and best bound.
+
+    With ``learn_nogoods``, on by default, the tiles behind every failed
+    simulation are remembered and states containing them are skipped
+    without simulating, see ``NogoodStore``. ``stats`` reports how many
+    states were pruned.
+
+    ``ordering`` picks which children are explored first, either one of the
+    names in ``ordering.ORDERINGS`` or a ``ChildOrdering`` instance.
+
+    With ``checkpoint`` the frontier, nogoods, best solution and counters
+    are saved to that file every ``checkpoint_interval`` iterations and when
+    the search stops. ``resume`` continues the search saved in a checkpoint
+    file, and keeps checkpointing to it unless ``checkpoint`` says otherwise.
+    The ordering saved in the checkpoint is restored, passing a different
+    one raises ``ValueError``.
+
+    ``start`` searches the subtree below that state instead of the whole
+    level, as the workers in ``distributed`` do. The cp backend keeps the
+    tiles placed on it as they are.
+
+    With ``use_pattern_db``, on by default, states whose trains are provably
+    too far from the destination are pruned before they are simulated, see
+    ``pattern_db``.
+    The table is built once per level and process, ``data`` is not changed.
 
-def solve(data: dict, method: str = "bfs"):
-    if method not in ["bfs", "dfs"]:
+    Nogoods, orderings, the pattern database and checkpoints belong to the
+    bfs and dfs search, passing any of them with ``"cp"`` raises
+    ``ValueError``. The cp backend reports its own ``stats``.
+    """
+    if method not in ["bfs", "dfs", "cp"]:
         raise ValueError("Invalid method")
-    trains = [
-        Train(
-            Position(train["x"], train["y"]),
-            train["direction"],
-            train["order"],
-        )
-        for train in data["trains"]
-    ]
-    effects = make_effects(data)
-    grid = Grid(data["grid"])
-    state = State(
-        grid=grid,
-        trains=trains,
-        destination=Position(*data["destination"]),
-        effects=effects,
-    )
-    queue = deque([state])
-    img = drawer.draw(state, debug=True, draw_cart=True)
-    cv2.imshow("image", cv2.cvtColor(np.array(img), cv2.COLOR_BGR2RGB))
-    cv2.waitKey(1000)
+    if resume is not None and checkpoint is None:
+        checkpoint = resume
+    if method == "cp":
+        unsupported = {
+            "checkpoint": checkpoint,
+            "learn_nogoods": learn_nogoods,
+            "ordering": ordering,
+            "use_pattern_db": use_pattern_db,
+        }
+        for name, value in unsupported.items():
+            if value is not None:
+                raise ValueError(f"{name} is only supported for bfs and dfs")
+    if learn_nogoods is None:
+        learn_nogoods = True
+    if use_pattern_db is None:
+        use_pattern_db = True
+    state = start if start is not None else make_state(data)
+
+    start_time = time.perf_counter()
+    best_min_placed_tiles = max_tracks(data)
 
+    def stop_reason(iteration: int) -> Optional[str]:
+        if deadline_s is not None and time.perf_counter() - start_time >= deadline_s:
+            return "deadline"
+        if max_nodes is not None and iteration >= max_nodes:
+            return "max_nodes"
+        if (
+            max_memory_mb is not None
+            and iteration % MEMORY_CHECK_INTERVAL == 0
+            and memory_usage_mb() >= max_memory_mb
+        ):
+            return "max_memory"
+        if cancel is not None and cancel.is_set():
+            return "cancelled"
+        return None
+
+    def report(iteration: int, frontier: int, best_solution: Optional[State]):
+        if on_progress is not None and iteration % progress_interval == 0:
+            on_progress(
+                {
+                    "iteration": iteration,
+                    "frontier": frontier,
+                    "best_placed_tiles": (
+                        best_solution.placed_tiles if best_solution else None
+                    ),
+                    "time": time.perf_counter() - start_time,
+                }
+            )
+
+    if method == "cp":
+        result = solve_cp(state, best_min_placed_tiles, stop_reason, report)
+        result["time"] = time.perf_counter() - start_time
+        return result
+
+    if isinstance(ordering, str):
+        if ordering not in ORDERINGS:
+            raise ValueError("Invalid ordering")
+        ordering = ORDERINGS[ordering]()
+    nogoods = NogoodStore() if learn_nogoods else None
+    database = pattern_database(data, state) if use_pattern_db else None
+    pattern_db_prunes = 0
+    first_solution_iteration = None
+    nogood_pops = 0
+    queue = deque([state])
     iteration = 0
+    status = "complete"
     best_solution = None
-    best_min_placed_tiles = data["max_tracks"] + 1 if "max_tracks" in data else 10000
+    if resume is not None:
+        queue, saved_nogoods, search = load_checkpoint(resume, method, data)
+        if nogoods is not None:
+            nogoods = saved_nogoods
+            nogoods.pruned = search["nogood_prunes"]
+        iteration = search["iteration"]
+        best_solution = search["best_solution"]
+        best_min_placed_tiles = search["best_min_placed_tiles"]
+        first_solution_iteration = search["first_solution_iteration"]
+        nogood_pops = search["nogood_pops"]
+        pattern_db_prunes = search["pattern_db_prunes"]
+        # the saved ordering carries the statistics learned so far
+        saved_ordering = search["ordering"]
+        if ordering is not None and type(ordering) is not type(saved_ordering):
+            raise ValueError(f"{resume} was written with another ordering")
+        ordering = saved_ordering
+
+    writer = CheckpointWriter(checkpoint, method, data) if checkpoint else None
+
+    def save_checkpoint():
+        writer.write(
+            queue,
+            nogoods,
+            {
+                "iteration": iteration,
+                "best_solution": best_solution,
+                "best_min_placed_tiles": best_min_placed_tiles,
+                "first_solution_iteration": first_solution_iteration,
+                "nogood_pops": nogood_pops,
+                "nogood_prunes": nogoods.pruned if nogoods is not None else 0,
+                "pattern_db_prunes": pattern_db_prunes,
+                "ordering": ordering,
+            },
+        )
+
     while queue:
+        reason = stop_reason(iteration)
+        if reason is not None:
+            status = reason
+            break
+        report(iteration, len(queue), best_solution)
+        if writer is not None and iteration % checkpoint_interval == 0:
+            save_checkpoint()
+
         iteration += 1
         if method == "dfs":
             state = queue.pop()
+            if writer is not None:
+                writer.journal.pop_right()
         if method == "bfs":
             state = queue.popleft()
+            if writer is not None:
+                writer.journal.pop_left()
 
         if state.placed_tiles > best_min_placed_tiles:
             continue
+        if (
+            database is not None
+            and tiles_lower_bound(database, state, best_min_placed_tiles)
+            > best_min_placed_tiles
+        ):
+            pattern_db_prunes += 1
+            continue
+
+        visited = None
+        if nogoods is not None:
+            # siblings queued before a nogood was learned are checked here
+            nogood_key = nogoods.key(state)
+            if nogoods.matches(state, nogood_key):
+                nogoods.pruned += 1
+                nogood_pops += 1
+                continue
+            visited = set()
 
         # img = drawer.draw(state, debug=True, draw_cart=True)
         # cv2.imshow("image", cv2.cvtColor(np.array(img), cv2.COLOR_BGR2RGB))
         # cv2.waitKey(1)
-        result = state.simulate()
+        result = state.simulate(visited)
+        if ordering is not None:
+            ordering.update(state, result)
 
         if result[0] == "empty_pos_reached":
             empty_positions = result[1]
-            possible_states = state.place_possible_tiles(empty_positions)
+            possible_states = state.place_possible_tiles(empty_positions, nogoods)
+            if ordering is not None:
+                possible_states = ordering.order(list(possible_states), empty_positions)
+                if method == "dfs":
+                    # the last child pushed is the first one explored
+                    possible_states.reverse()
+            queue_size = len(queue)
             queue.extend(possible_states)
+            if writer is not None:
+                writer.journal.push(len(queue) - queue_size)
+        elif result[0] != "success" and nogoods is not None:
+            nogoods.add(nogood_key, state, visited)
 
         if result[0] == "success":
             if state.placed_tiles <= best_min_placed_tiles:
                 best_solution = state
                 best_min_placed_tiles = state.placed_tiles
+                if first_solution_iteration is None:
+                    first_solution_iteration = iteration
 
+    # placed_tiles never decreases along a branch, so the cheapest state left
+    # in the frontier bounds every solution that was not explored yet. The
+    # pattern database bound of a state holds for its whole subtree too.
+    lower_bound = min(
+        (
+            tiles_lower_bound(database, s, best_min_placed_tiles)
+            if database is not None
+            else s.placed_tiles
+            for s in queue
+            if s.placed_tiles <= best_min_placed_tiles
+        ),
+        default=best_min_placed_tiles,
+    )
+    lower_bound = min(lower_bound, best_min_placed_tiles)
+    upper_bound = best_solution.placed_tiles if best_solution is not None else None
+    if writer is not None:
+        save_checkpoint()
+        writer.close()
+    queue.clear()
     return {
         "best_solution": best_solution,
         "iteration": iteration,
+        "status": status,
+        "lower_bound": lower_bound,
+        "gap": upper_bound - lower_bound if upper_bound is not None else None,
+        "time": time.perf_counter() - start_time,
+        "stats": {
+            "first_solution_iteration": first_solution_iteration,
+            "nogoods": nogoods.size if nogoods is not None else 0,
+            "nogood_prunes": nogoods.pruned if nogoods is not None else 0,
+            # states pruned while popping were already counted as iterations
+            "nogood_prune_rate": (
+                nogoods.pruned / (iteration + nogoods.pruned - nogood_pops)
+                if nogoods is not None and iteration
+                else 0.0
+            ),
+            "pattern_db_prunes": pattern_db_prunes,
+        },
     }
 
 
-def solve_all():
+def solve_all(profile_dir=None):
+    """Solve every level, with a sampled profile per level in ``profile_dir``."""
     levels = os.listdir("./src/levels/")
     levels = sorted(levels, key=lambda x: list(map(int, re.findall(r"\d+", x))))
+    solved = []
+    # solved grids for verify.py to check later changes against
+    solutions = {}
     for filename in levels:
         if filename.endswith(".json"):
             file_path = os.path.join("./src/levels/", filename)
             data = load_data(file_path)
             start_time = time.time()
             print(f"Solving {filename}")
-            solution = solve(data, "bfs")
+            if profile_dir is not None:
+                from profiler import SamplingProfiler
+
+                os.makedirs(profile_dir, exist_ok=True)
+                with SamplingProfiler(name=filename) as profiler:
+                    solution = solve(data, "bfs")
+                profiler.write(
+                    os.path.join(profile_dir, f"{filename.split('.')[0]}.collapsed")
+                )
+            else:
+                solution = solve(data, "bfs")
             print("--- %s seconds ---" % (time.time() - start_time))
             if solution["best_solution"] is not None:
                 print(f'Found solution in {solution["iteration"]} iterations')
-                img = drawer.draw(solution["best_solution"])
+                solutions[filename] = {
+                    "placed_tiles": solution["best_solution"].placed_tiles,
+                    "grid": solution["best_solution"].grid.data.tolist(),
+                }
                 # save to ./src/solutions
-                cv2.imwrite(
-                    f"./src/solutions/{filename.split('.')[0]}.png",
-                    cv2.cvtColor(np.array(img), cv2.COLOR_BGR2RGB),
+                solved.append(
+                    (
+                        solution["best_solution"],
+                        f"./src/solutions/{filename.split('.')[0]}.png",
+                    )
                 )
+    drawer.export_batch(solved)
+    with open(SOLUTIONS_PATH, "w") as file:
+        json.dump(solutions, file)
 
 
-def solve_one(filepath, showImage=False):
+def solve_one(filepath, showImage=False, **limits):
     data = load_data(filepath)
     start_time = time.time()
     print(f"Solving {filepath}")
-    solution = solve(data, "bfs")
+    solution = solve(data, "bfs", **limits)
     print("--- %s seconds ---" % (time.time() - start_time))
+    if solution["status"] != "complete":
+        print(
+            f'Stopped by {solution["status"]}, lower bound: {solution["lower_bound"]},'
+            f' gap: {solution["gap"]}'
+        )
     if solution["best_solution"] is not None:
         print(f'Found solution in {solution["iteration"]} iterations')
         print(f"Placed tiles: {solution['best_solution'].placed_tiles}")
@@ -141,17 +365,31 @@ def solve_one(filepath, showImage=False):
             cv2.waitKey(0)
 
 
-def run_profile(filepath):
-    import cProfile
-    import pstats
+def run_profile(filepath, output=None, deterministic=False):
+    """Profile one solve by sampling, or with cProfile when ``deterministic``.
 
-    with cProfile.Profile() as pr:
-        solve_one(filepath)
+    The sampled profile goes to ``output``, speedscope unless the name ends
+    in ``.collapsed``.
+    """
+    if deterministic:
+        import cProfile
+        import pstats
 
-    result = pstats.Stats(pr)
-    result.sort_stats(pstats.SortKey.TIME)
-    result.print_stats()
-    result.dump_stats("solver_stats")
+        with cProfile.Profile() as pr:
+            solve_one(filepath)
+
+        result = pstats.Stats(pr)
+        result.sort_stats(pstats.SortKey.TIME)
+        result.print_stats()
+        result.dump_stats("solver_stats")
+        return
+
+    from profiler import SamplingProfiler
+
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    with SamplingProfiler(name=name) as profiler:
+        solve_one(filepath)
+    profiler.write(output or f"{name}.speedscope.json")
 
 
 if __name__ == "__main__":
@@ -1,10 +1,13 @@
 import copy
 from dataclasses import dataclass
-from typing import Optional
+from typing import TYPE_CHECKING, Iterator, Optional
 
 from grid import Grid
 from tile import TILES_CONNECT, Direction, Position, Tile
 
+if TYPE_CHECKING:
+    from nogood import NogoodStore
+
 
 @dataclass
 class Train:
@@ -49,6 +52,8 @@ class State:
     placed_tiles: int = 0
     immutable_positions: Optional[set[Position]] = None
     effects: Optional[dict[Position, tuple[str, any]]] = None
+    # cells filled by the expansion that created this state
+    last_placed: tuple[Position, ...] = ()
 
     def __post_init__(self):
         if self.immutable_positions is None:
@@ -73,6 +78,7 @@ class State:
             self.placed_tiles,
             self.immutable_positions,
             self.effects,
+            self.last_placed,
         )
 
     def __deepcopy__(self, memo):
@@ -84,200 +90,257 @@ class State:
             self.placed_tiles,
             self.immutable_positions,
             self.effects,
+            self.last_placed,
         )
 
-    def simulate(self):
+    @property
+    def max_steps(self) -> int:
+        # A train's next (position, direction) only depends on the current
+        # one, so a train that has not stopped after visiting every
+        # (cell, direction) pair is running in a cycle.
+        return 4 * self.grid.width * self.grid.height + 1
+
+    def simulate(self, visited: Optional[set[Position]] = None):
+        seen: set[tuple] = set()
+        for _ in range(self.max_steps):
+            result = self.step(visited)
+            if result is not None:
+                return result
+            # the grid does not change while simulating, so a repeated
+            # configuration means the trains will loop forever
+            configuration = self._configuration()
+            if configuration in seen:
+                return ("loop_detected", "trains are running in a loop")
+            seen.add(configuration)
+        return ("max_iter_reached", "max iteration reached")
+
+    def _configuration(self) -> tuple:
+        return (
+            self.order_counter,
+            tuple((train.position, train.direction) for train in self.trains),
+        )
+
+    def step(self, visited: Optional[set[Position]] = None):
+        """Advance every train by one tile.
+
+        Returns ``None`` while the trains keep running on placed tracks,
+        otherwise the outcome that ``simulate`` reports. Every cell whose
+        tile is looked at is added to ``visited`` when it is given.
+        """
         empty_pos_reached = []
-        max_iter = 100
-        while len(empty_pos_reached) == 0 and max_iter > 0:
-            max_iter -= 1
-            # update train position and check for empty position reached
-            for train in self.trains:
-                if train.position == self.destination:
-                    continue
-                current_tile = Tile(self.grid.get(*train.position))
-                if train.position in self.effects:
-                    effect = self.effects[train.position]
-                    if effect[0] == "tunnel":
-                        output_direction = copy.copy(effect[2])
-                        next_position = Position(*effect[1]) + output_direction.delta
-                        train.previous_position = train.position
-                        train.position = next_position
-                        train.direction = output_direction
-                else:
-                    output_direction = current_tile.get_output_direction(
-                        train.direction
-                    )
-                    if output_direction == -1:
-                        return ("wrong_direction", "invalid track direction")
-                    next_position = train.position + output_direction.delta
+        # update train position and check for empty position reached
+        for train in self.trains:
+            if train.position == self.destination:
+                continue
+            if visited is not None:
+                visited.add(train.position)
+            current_tile = Tile(self.grid.get(*train.position))
+            if train.position in self.effects:
+                effect = self.effects[train.position]
+                if effect[0] == "tunnel":
+                    output_direction = copy.copy(effect[2])
+                    next_position = Position(*effect[1]) + output_direction.delta
                     train.previous_position = train.position
                     train.position = next_position
                     train.direction = output_direction
+            else:
+                output_direction = current_tile.get_output_direction(train.direction)
+                if output_direction == -1:
+                    return ("wrong_direction", "invalid track direction")
+                next_position = train.position + output_direction.delta
+                train.previous_position = train.position
+                train.position = next_position
+                train.direction = output_direction
 
-                if (0 <= next_position.x < self.grid.width) and (
-                    0 <= next_position.y < self.grid.height
-                ):
-                    next_tile = self.grid.get(next_position.x, next_position.y)
-                    if next_tile == Tile.EMPTY:
-                        empty_pos_reached.append((next_position, output_direction))
-
-                    # TODO: SIMULATE INTERACTION OF THE TILE IF NEEDED
-
-                if next_position == self.destination:
-                    if train.order == self.order_counter + 1:
-                        self.order_counter += 1
-                    else:
-                        return (
-                            "wrong_order",
-                            "train reached destination in wrong order",
-                        )
-            # check for collision
-            for train in self.trains:
-                if train.position == self.destination:
-                    continue
-                # is train run out of the board
-                if not (
-                    0 <= train.position.x < self.grid.width
-                    and 0 <= train.position.y < self.grid.height
-                ):
-                    return ("collision", "train run out of the board")
-                if self.grid.get(*train.position) == Tile.FENCE:
-                    return ("collision", "train hit FENCE")
+            if (0 <= next_position.x < self.grid.width) and (
+                0 <= next_position.y < self.grid.height
+            ):
+                if visited is not None:
+                    visited.add(next_position)
+                next_tile = self.grid.get(next_position.x, next_position.y)
+                if next_tile == Tile.EMPTY:
+                    empty_pos_reached.append((next_position, output_direction))
 
-                for other_cart in self.trains:
-                    if train == other_cart:
-                        continue
-                    if train.position == other_cart.position:
-                        return ("collision", "train collision")
-                    if (
-                        train.position == other_cart.previous_position
-                        and train.previous_position == other_cart.position
-                    ):
-                        return ("collision", "train collision")
-            # check if all trains reached destination
-            if all(train.position == self.destination for train in self.trains):
-                return ("success", "all trains reached destination")
-        if max_iter == 0:
-            return ("max_iter_reached", "max iteration reached")
-        return ("empty_pos_reached", list(empty_pos_reached))
-
-    def place_possible_tiles(self, empty_positions: list[tuple[Position, Direction]]):
-        new_grids: list[State] = []
-        self._recursive_tile_placement(empty_positions, 0, self.grid, new_grids)
-        new_states = [
-            State(
-                grid,
+                # TODO: SIMULATE INTERACTION OF THE TILE IF NEEDED
+
+            if next_position == self.destination:
+                if train.order == self.order_counter + 1:
+                    self.order_counter += 1
+                else:
+                    return (
+                        "wrong_order",
+                        "train reached destination in wrong order",
+                    )
+        collision = self.collision()
+        if collision is not None:
+            return collision
+        # check if all trains reached destination
+        if all(train.position == self.destination for train in self.trains):
+            return ("success", "all trains reached destination")
+        if empty_pos_reached:
+            return ("empty_pos_reached", empty_pos_reached)
+        return None
+
+    def collision(self) -> Optional[tuple[str, str]]:
+        """The first train that left the board, hit a fence or met another."""
+        # each train claims its cell and the edge it travelled along, so
+        # meeting trains are found in one pass
+        occupied: set[Position] = set()
+        travelled: set[tuple[Position, Position]] = set()
+        for train in self.trains:
+            if train.position == self.destination:
+                continue
+            # is train run out of the board
+            if not (
+                0 <= train.position.x < self.grid.width
+                and 0 <= train.position.y < self.grid.height
+            ):
+                return ("collision", "train run out of the board")
+            if self.grid.get(*train.position) == Tile.FENCE:
+                return ("collision", "train hit FENCE")
+
+            if train.position in occupied:
+                return ("collision", "train collision")
+            # two trains swapping cells pass each other head-on
+            if (train.position, train.previous_position) in travelled:
+                return ("collision", "train collision")
+            occupied.add(train.position)
+            travelled.add((train.previous_position, train.position))
+        return None
+
+    def place_possible_tiles(
+        self,
+        empty_positions: list[tuple[Position, Direction]],
+        nogoods: Optional["NogoodStore"] = None,
+    ) -> Iterator["State"]:
+        """Yield every valid way to fill the empty positions the trains reached.
+
+        Candidates are placed on a single working grid and a prefix is dropped
+        as soon as one of its tiles points into a neighbour that can never
+        connect back, so only the grids that survive are copied. Children
+        matching one of the ``nogoods`` are counted in ``nogoods.pruned``
+        and skipped.
+        """
+        # every child starts from the trains as they are now
+        nogood_key = nogoods.key(self) if nogoods is not None else None
+        working_grid = copy.deepcopy(self.grid)
+        for grid in self._tile_placements(empty_positions, 0, working_grid):
+            state = State(
+                copy.deepcopy(grid),
                 copy.deepcopy(self.trains),
                 self.destination,
                 self.order_counter,
                 self.placed_tiles + len(empty_positions),
                 self.immutable_positions,
                 self.effects,
+                tuple(pos for pos, _ in empty_positions),
             )
-            for grid in new_grids
-        ]
-        # Try to fix invalid placements
-        result = []
-        for state in new_states:
-            for pos, input_direction in empty_positions:
-                tile = Tile(state.grid.get(pos.x, pos.y))
-                if not state.is_valid_placement(pos, tile):
-                    output_direction = tile.get_output_direction(input_direction)
-                    adjacent_pos = pos + output_direction.delta
-                    # try to change the adjacent tile to make the placement valid
+            # Try to fix invalid placements
+            state._repair_placement(empty_positions)
+            # filtering out invalid placements
+            if not all(
+                state.is_valid_placement(pos, Tile(state.grid.get(pos.x, pos.y)))
+                for pos, _ in empty_positions
+            ):
+                continue
+            if nogoods is not None and nogoods.matches(state, nogood_key):
+                nogoods.pruned += 1
+                continue
+            yield state
+
+    def _repair_placement(self, empty_positions: list[tuple[Position, Direction]]):
+        for pos, input_direction in empty_positions:
+            tile = Tile(self.grid.get(pos.x, pos.y))
+            if not self.is_valid_placement(pos, tile):
+                output_direction = tile.get_output_direction(input_direction)
+                adjacent_pos = pos + output_direction.delta
+                # try to change the adjacent tile to make the placement valid
+                if (
+                    0 <= adjacent_pos.x < self.grid.width
+                    and 0 <= adjacent_pos.y < self.grid.height
+                    and adjacent_pos not in self.immutable_positions
+                ):
+                    adjacent_tile = Tile(
+                        self.grid.get(adjacent_pos.x, adjacent_pos.y)
+                    )
                     if (
-                        0 <= adjacent_pos.x < state.grid.width
-                        and 0 <= adjacent_pos.y < state.grid.height
-                        and adjacent_pos not in self.immutable_positions
+                        adjacent_tile != Tile.EMPTY
+                        and adjacent_tile != Tile.FENCE
+                        and not adjacent_tile.is_t_turn
+                        and not TILES_CONNECT[tile][adjacent_tile][output_direction]
                     ):
-                        adjacent_tile = Tile(
-                            state.grid.get(adjacent_pos.x, adjacent_pos.y)
-                        )
-                        if (
-                            adjacent_tile != Tile.EMPTY
-                            and adjacent_tile != Tile.FENCE
-                            and not adjacent_tile.is_t_turn
-                            and not TILES_CONNECT[tile][adjacent_tile][output_direction]
-                        ):
-                            if adjacent_tile.is_curve:
+                        if adjacent_tile.is_curve:
+                            to_change = adjacent_tile.to_t_turn(
+                                output_direction.opposite
+                            )
+                            if to_change != -1:
+                                self.grid.set(
+                                    adjacent_pos.x,
+                                    adjacent_pos.y,
+                                    to_change,
+                                )
+                        if adjacent_tile.is_straight:
+                            flow = self.grid.get_flow(
+                                adjacent_pos.x, adjacent_pos.y
+                            )
+
+                            if len(flow) == 1:
+                                key = next(iter(flow))
                                 to_change = adjacent_tile.to_t_turn(
-                                    output_direction.opposite
+                                    output_direction.opposite, key
                                 )
                                 if to_change != -1:
-                                    state.grid.set(
+                                    self.grid.set(
                                         adjacent_pos.x,
                                         adjacent_pos.y,
                                         to_change,
                                     )
-                            if adjacent_tile.is_straight:
-                                flow = state.grid.get_flow(
-                                    adjacent_pos.x, adjacent_pos.y
-                                )
 
-                                if len(flow) == 1:
-                                    key = next(iter(flow))
-                                    to_change = adjacent_tile.to_t_turn(
-                                        output_direction.opposite, key
-                                    )
-                                    if to_change != -1:
-                                        state.grid.set(
-                                            adjacent_pos.x,
-                                            adjacent_pos.y,
-                                            to_change,
-                                        )
-
-                    # try to change the current tile to make the placement valid
-                    for direction in Direction:
+                # try to change the current tile to make the placement valid
+                for direction in Direction:
+                    if (
+                        direction == input_direction.opposite
+                        or direction == output_direction
+                    ):
+                        continue
+                    adjacent_pos = pos + direction.delta
+                    if (
+                        0 <= adjacent_pos.x < self.grid.width
+                        and 0 <= adjacent_pos.y < self.grid.height
+                    ):
+                        adjacent_tile = Tile(
+                            self.grid.get(adjacent_pos.x, adjacent_pos.y)
+                        )
                         if (
-                            direction == input_direction.opposite
-                            or direction == output_direction
+                            adjacent_tile == Tile.EMPTY
+                            or adjacent_tile == Tile.FENCE
                         ):
                             continue
-                        adjacent_pos = pos + direction.delta
-                        if (
-                            0 <= adjacent_pos.x < state.grid.width
-                            and 0 <= adjacent_pos.y < state.grid.height
-                        ):
-                            adjacent_tile = Tile(
-                                state.grid.get(adjacent_pos.x, adjacent_pos.y)
-                            )
-                            if (
-                                adjacent_tile == Tile.EMPTY
-                                or adjacent_tile == Tile.FENCE
-                            ):
-                                continue
-                            adj_connection = adjacent_tile.get_connection_direction()
-                            if adj_connection[direction.opposite]:
-                                direction_flow = None
-                                if tile.is_straight:
-                                    direction_flow = input_direction
-                                to_change = tile.to_t_turn(direction, direction_flow)
-                                if to_change != -1:
-                                    state.grid.set(pos.x, pos.y, to_change)
-        # filtering out invalid placements
-        result = [
-            state
-            for state in new_states
-            if all(
-                state.is_valid_placement(pos, Tile(state.grid.get(pos.x, pos.y)))
-                for pos, _ in empty_positions
-            )
-        ]
-        return result
+                        adj_connection = adjacent_tile.get_connection_direction()
+                        if adj_connection[direction.opposite]:
+                            direction_flow = None
+                            if tile.is_straight:
+                                direction_flow = input_direction
+                            to_change = tile.to_t_turn(direction, direction_flow)
+                            if to_change != -1:
+                                self.grid.set(pos.x, pos.y, to_change)
 
-    def _recursive_tile_placement(
+    def _tile_placements(
         self,
         empty_positions: list[tuple[Position, Direction]],
         index: int,
-        current_grid: "Grid",
-        new_grids: list["Grid"],
-    ):
+        grid: "Grid",
+    ) -> Iterator["Grid"]:
+        # yields the same working grid for every complete placement, callers
+        # must copy it before resuming
         if index == len(empty_positions):
-            new_grids.append(current_grid)
+            yield grid
             return
 
         pos, direction = empty_positions[index]
+        final = all(other != pos for other, _ in empty_positions[index + 1 :])
+        previous_tile = grid.get(pos.x, pos.y)
+        previous_flow = grid.flows[pos.y, pos.x]
         for tile in [
             Tile.STRAIGHT_H,
             Tile.STRAIGHT_V,
@@ -297,14 +360,37 @@ class State:
                     and not TILES_CONNECT[tile][adjacent_tile][direction.opposite]
                 ):
                     continue
+            if final and self._is_dead_end(grid, pos, tile):
+                continue
 
-            new_grid = copy.deepcopy(current_grid)
-            new_grid.set(pos.x, pos.y, tile)
+            grid.set(pos.x, pos.y, tile)
             if tile.is_straight:
-                new_grid.add_flow(pos.x, pos.y, direction)
-            self._recursive_tile_placement(
-                empty_positions, index + 1, new_grid, new_grids
-            )
+                grid.add_flow(pos.x, pos.y, direction)
+            yield from self._tile_placements(empty_positions, index + 1, grid)
+            grid.set(pos.x, pos.y, previous_tile)
+            grid.flows[pos.y, pos.x] = previous_flow
+
+    def _is_dead_end(self, grid: "Grid", pos: Position, tile: Tile) -> bool:
+        # Repairs only turn curves and straights into T-turns, which keeps
+        # their connections. A tile pointing into an immutable tile or a
+        # T-turn that does not connect back can therefore never become valid.
+        connection = tile.get_connection_direction()
+        for direction in Direction:
+            if not connection[direction]:
+                continue
+            adjacent_pos = pos + direction.delta
+            if not (
+                0 <= adjacent_pos.x < grid.width and 0 <= adjacent_pos.y < grid.height
+            ):
+                continue
+            adjacent_tile = Tile(grid.get(adjacent_pos.x, adjacent_pos.y))
+            if adjacent_tile == Tile.EMPTY:
+                continue
+            if (
+                adjacent_pos in self.immutable_positions or adjacent_tile.is_t_turn
+            ) and not TILES_CONNECT[tile][adjacent_tile][direction]:
+                return True
+        return False
 
     def is_valid_placement(self, pos: Position, new_tile: Tile) -> bool:
         for direction in Direction:
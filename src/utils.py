@@ -3,6 +3,13 @@ from collections import defaultdict
 from contextlib import contextmanager
 from statistics import mean
 import json
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 
 def load_data(file_path: str) -> dict:
@@ -10,6 +17,28 @@ def load_data(file_path: str) -> dict:
         return json.load(file)
 
 
+def memory_usage_mb() -> float:
+    """Resident memory of the current process in megabytes.
+
+    Read from ``/proc/self/statm`` where it exists. Elsewhere only the peak
+    resident memory is available, which never goes down again. Raises
+    ``RuntimeError`` on platforms that report neither, such as Windows.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        raise RuntimeError("Memory usage cannot be read on this platform")
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return usage / (1024 * 1024)
+    return usage / 1024
+
+
 class TimingManager:
     def __init__(self, enabled=True):
         self.execution_times = defaultdict(list)
@@ -0,0 +1,157 @@
+"""Check solved grids without searching again.
+
+A solution is valid when the level's own tiles are untouched, everything
+else on the grid is a placeable track, no more than ``max_tracks`` tiles
+were placed and ``State.simulate`` brings every train home in order. Only
+the level and state modules are imported, so a check costs about a
+millisecond and a whole level set fits in a pre-merge hook.
+
+    python src/verify.py                                  # ./src/solutions/solutions.json
+    python src/verify.py --solutions other.json --workers 8
+    python src/verify.py ./src/levels/2-4.json grid.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Union
+
+import numpy as np
+
+from grid import Grid
+from level import make_state, max_tracks
+from tile import Tile
+from utils import load_data
+
+SOLUTIONS_PATH = "./src/solutions/solutions.json"
+
+PLACEABLE_VALUES = [
+    int(tile) for tile in Tile if tile.is_straight or tile.is_curve or tile.is_t_turn
+]
+
+# below this many solutions starting worker processes costs more than it saves
+PARALLEL_THRESHOLD = 64
+
+
+def _failure(reason: str, placed_tiles: Optional[int] = None) -> dict:
+    return {"ok": False, "reason": reason, "placed_tiles": placed_tiles}
+
+
+def verify(
+    data: dict, grid: Union[Grid, list], placed_tiles: Optional[int] = None
+) -> dict:
+    """Check ``grid`` as a solution of ``data``.
+
+    ``placed_tiles`` is the tile count stored with the solution, if any.
+    """
+    if not isinstance(grid, Grid):
+        grid = Grid(grid)
+    level = np.asarray(data["grid"])
+    if grid.data.shape != level.shape:
+        return _failure("grid size does not match the level")
+
+    fixed = level != Tile.EMPTY
+    changed = fixed & (grid.data != level)
+    if changed.any():
+        y, x = np.argwhere(changed)[0]
+        return _failure(f"fixed tile at ({x}, {y}) was changed")
+    placed = ~fixed & (grid.data != Tile.EMPTY)
+    invalid = placed & ~np.isin(grid.data, PLACEABLE_VALUES)
+    if invalid.any():
+        y, x = np.argwhere(invalid)[0]
+        return _failure(f"tile at ({x}, {y}) cannot be placed")
+    count = int(placed.sum())
+    limit = max_tracks(data)
+    if count > limit:
+        return _failure(f"{count} tiles placed, max_tracks is {limit}", count)
+    if placed_tiles is not None and placed_tiles != count:
+        return _failure(f"stored tile count {placed_tiles} but {count} placed", count)
+
+    result = make_state(data, grid).simulate()
+    if result[0] != "success":
+        return _failure(f"{result[0]}: {result[1]}", count)
+    return {"ok": True, "reason": None, "placed_tiles": count}
+
+
+def _verify_item(item: tuple[dict, list, Optional[int]]) -> dict:
+    try:
+        return verify(*item)
+    except Exception as e:
+        return _failure(f"error: {e}")
+
+
+def verify_batch(
+    items: list[tuple[dict, list, Optional[int]]], workers: Optional[int] = None
+) -> list[dict]:
+    """Verify (level, grid, stored tile count) triples, in parallel when it pays."""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(items) < PARALLEL_THRESHOLD:
+        return [_verify_item(item) for item in items]
+    chunksize = max(1, len(items) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_verify_item, items, chunksize=chunksize))
+
+
+def verify_levels(
+    levels_folder: str = "./src/levels",
+    solutions_path: str = SOLUTIONS_PATH,
+    workers: Optional[int] = None,
+) -> dict[str, dict]:
+    """Verify the stored solution of every level that has one."""
+    with open(solutions_path) as file:
+        solutions = json.load(file)
+    names = [
+        name
+        for name in sorted(solutions)
+        if os.path.exists(os.path.join(levels_folder, name))
+    ]
+    items = [
+        (
+            load_data(os.path.join(levels_folder, name)),
+            solutions[name]["grid"],
+            solutions[name].get("placed_tiles"),
+        )
+        for name in names
+    ]
+    return dict(zip(names, verify_batch(items, workers)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify stored solutions")
+    parser.add_argument("level", nargs="?", help="level file to check one grid")
+    parser.add_argument("grid", nargs="?", help="json file with the solved grid")
+    parser.add_argument("--levels", default="./src/levels")
+    parser.add_argument("--solutions", default=SOLUTIONS_PATH)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    if args.level:
+        if not args.grid:
+            parser.error("a level needs a grid to verify")
+        solution = load_data(args.grid)
+        # a bare grid or a solution as the solver service returns it
+        if isinstance(solution, dict):
+            results = {
+                args.level: verify(
+                    load_data(args.level),
+                    solution["grid"],
+                    solution.get("placed_tiles"),
+                )
+            }
+        else:
+            results = {args.level: verify(load_data(args.level), solution)}
+    else:
+        results = verify_levels(args.levels, args.solutions, args.workers)
+
+    failed = {name: result for name, result in results.items() if not result["ok"]}
+    for name, result in failed.items():
+        print(f"{name}: {result['reason']}")
+    print(
+        f"Verified {len(results)} solutions in"
+        f" {time.perf_counter() - start_time:.3f}s, {len(failed)} failed"
+    )
+    sys.exit(1 if failed else 0)